@@ -0,0 +1,42 @@
+"""Micro-benchmark comparing parsing problem text with decoding the compact
+binary encoding from `MathExpression.to_bytes`, on generated "hard" problems.
+
+Run from the package folder with mathy installed (e.g. `pip install -e .`):
+
+    python benchmarks/encoding.py [num_problems] [repeat]
+
+Caches are disabled, so every call parses.
+"""
+import pickle
+import sys
+import timeit
+
+from mathy import ExpressionParser, MathExpression, MathyEnvProblemArgs
+from mathy.envs import ComplexSimplify, PolySimplify, PolySimplifyBlockers
+from mathy.types import MathyEnvDifficulty
+
+
+def main(num_problems: int = 300, repeat: int = 5):
+    args = MathyEnvProblemArgs(difficulty=MathyEnvDifficulty.hard)
+    envs = [PolySimplify(), ComplexSimplify(), PolySimplifyBlockers()]
+    texts = [envs[i % len(envs)].problem_fn(args).text for i in range(num_problems)]
+    parser = ExpressionParser(0, 0)
+    trees = [parser.parse(t) for t in texts]
+    encoded = [t.to_bytes() for t in trees]
+    pickled = [pickle.dumps(t) for t in trees]
+    for name, payloads in [("text", texts), ("bytes", encoded), ("pickle", pickled)]:
+        size = sum([len(p) for p in payloads]) / num_problems
+        print(f"{name:<8} {size:8.1f} bytes/problem")
+    for name, fn in [
+        ("parse", lambda: [parser.parse(t) for t in texts]),
+        ("from_bytes", lambda: [MathExpression.from_bytes(d) for d in encoded]),
+        ("unpickle", lambda: [pickle.loads(d) for d in pickled]),
+        ("to_bytes", lambda: [t.to_bytes() for t in trees]),
+    ]:
+        seconds = timeit.timeit(fn, number=repeat)
+        per_problem = seconds / (repeat * num_problems) * 1e6
+        print(f"{name:<12} {per_problem:10.2f} us/problem")
+
+
+if __name__ == "__main__":
+    main(*[int(a) for a in sys.argv[1:]])
@@ -0,0 +1,52 @@
+"""Micro-benchmark comparing a loop of `parse` calls with `parse_many` using
+one and many worker processes, on generated polynomial simplification problems.
+
+Run from the package folder with mathy installed (e.g. `pip install -e .`):
+
+    python benchmarks/parse_many.py [num_problems] [workers] [repeats]
+
+Caches are disabled for the loop so that every problem is parsed, and the best
+of three runs is shown for each case. The problems
+are parsed once as they are, and once with each problem repeated `repeats`
+times, like the problems of a training set that is sampled many times.
+"""
+import os
+import random
+import sys
+import timeit
+from typing import List
+
+from mathy import ExpressionParser
+from mathy.problems import gen_simplify_multiple_terms
+
+
+def main(num_problems: int = 4000, workers: int = 0, repeats: int = 4):
+    workers = workers or os.cpu_count() or 1
+    unique = [gen_simplify_multiple_terms(12)[0] for _ in range(num_problems)]
+    repeated = random.sample(unique * repeats, num_problems * repeats)
+    print(f"{num_problems} problems, {workers} workers, {os.cpu_count()} CPUs")
+
+    def loop(texts: List[str]):
+        parser = ExpressionParser(parse_cache_size=0, tokens_cache_size=0)
+        return [parser.parse(text) for text in texts]
+
+    for label, texts in [("unique", unique), (f"x{repeats} repeats", repeated)]:
+        print(f"{len(texts)} problems, {label}")
+        for name, fn in [
+            ("parse loop", loop),
+            ("parse_many", lambda t: ExpressionParser().parse_many(t, workers=1)),
+            (
+                f"parse_many x{workers}",
+                lambda t: ExpressionParser().parse_many(t, workers=workers),
+            ),
+            (
+                f"parse_many x{workers} flat",
+                lambda t: ExpressionParser().parse_many(t, workers, flat=True),
+            ),
+        ]:
+            seconds = min(timeit.repeat(lambda: fn(texts), number=1, repeat=3))
+            print(f"  {name:<24} {seconds / len(texts) * 1e6:10.2f} us/problem")
+
+
+if __name__ == "__main__":
+    main(*[int(a) for a in sys.argv[1:]])
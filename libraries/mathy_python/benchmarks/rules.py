@@ -0,0 +1,82 @@
+"""Micro-benchmark comparing matching the core rules against generated "hard"
+problems with one `find_nodes` traversal per rule, and with the single
+traversal of `match_rules`, which only calls the rules whose `node_types`
+include each node's class.
+
+It also compares matching a problem again after applying one random valid
+action, from scratch and incrementally with `MathyEnv.cache_changed_rule_matches`.
+
+Run from the package folder with mathy installed (e.g. `pip install -e .`):
+
+    python benchmarks/rules.py [num_problems] [repeat]
+"""
+import random
+import sys
+import timeit
+from typing import List
+
+from mathy import ExpressionParser, MathExpression, MathyEnvProblemArgs
+from mathy.core.rule import BaseRule, match_rules
+from mathy.env import MathyEnv
+from mathy.envs import ComplexSimplify, PolySimplify, PolySimplifyBlockers
+from mathy.types import MathyEnvDifficulty
+
+
+def match_each_rule(expression: MathExpression, rules: List[BaseRule]):
+    """The original per-rule matching of `MathyEnv.get_actions_for_node` and
+    `MathyEnv.get_valid_rules`"""
+    rule_count = len(rules)
+    actions = [0] * rule_count * expression.size
+    valid = [0] * rule_count
+    for rule_index, rule in enumerate(rules):
+        nodes = rule.find_nodes(expression)
+        for node in nodes:
+            actions[(node.r_index * rule_count) + rule_index] = 1
+        valid[rule_index] = 0 if len(nodes) == 0 else 1
+    return actions, valid
+
+
+def main(num_problems: int = 300, repeat: int = 5):
+    args = MathyEnvProblemArgs(difficulty=MathyEnvDifficulty.hard)
+    envs = [PolySimplify(), ComplexSimplify(), PolySimplifyBlockers()]
+    parser = ExpressionParser()
+    trees = [
+        parser.parse(envs[i % len(envs)].problem_fn(args).text)
+        for i in range(num_problems)
+    ]
+    rules = MathyEnv.core_rules()
+    print(f"{num_problems} hard problems, {len(rules)} rules")
+    for name, fn in [
+        ("find_nodes per rule", lambda: [match_each_rule(t, rules) for t in trees]),
+        ("match_rules", lambda: [match_rules(t, rules) for t in trees]),
+    ]:
+        seconds = timeit.timeit(fn, number=repeat)
+        per_problem = seconds / (repeat * num_problems) * 1e6
+        print(f"{name:<20} {per_problem:10.2f} us/problem")
+
+    # Apply a random valid action to each problem
+    env = MathyEnv()
+    changes = []
+    for tree in trees:
+        mask = env.cache_rule_matches(tree).actions
+        action = random.choice([i for i, v in enumerate(mask) if v])
+        rule_index, token_index = env.get_action_indices(action)
+        token = tree.get_node_at_index(token_index)
+        changes.append((tree, env.rules[rule_index].apply_to(token.clone_from_root())))
+    for name, fn in [
+        (
+            "match after change",
+            lambda: [env.rule_dispatch.match(c.result.get_root()) for _, c in changes],
+        ),
+        (
+            "rematch after change",
+            lambda: [env.cache_changed_rule_matches(t, c) for t, c in changes],
+        ),
+    ]:
+        seconds = timeit.timeit(fn, number=repeat)
+        per_problem = seconds / (repeat * num_problems) * 1e6
+        print(f"{name:<20} {per_problem:10.2f} us/problem")
+
+
+if __name__ == "__main__":
+    main(*[int(a) for a in sys.argv[1:]])
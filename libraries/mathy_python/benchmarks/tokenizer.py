@@ -0,0 +1,63 @@
+"""Micro-benchmark comparing the single-pass tokenizer with the original one,
+which re-sliced the remaining input for every token, on long generated
+polynomial simplification problems.
+
+Run from the package folder with mathy installed (e.g. `pip install -e .`):
+
+    python benchmarks/tokenizer.py [num_problems] [repeat] [chunks]
+
+Each problem joins `chunks` generated 20 term problems with "+".
+"""
+import sys
+import timeit
+from typing import List
+
+from mathy.core.tokenizer import Token, TokenContext, TokenEOF, Tokenizer
+from mathy.problems import gen_simplify_multiple_terms
+
+
+class SlicingTokenizer(Tokenizer):
+    """The original tokenizer, which copies the rest of the input for every
+    token it reads"""
+
+    def eat_token(self, context: TokenContext, typeFn):
+        res = ""
+        for ch in list(context.buffer[context.index :]):
+            if not typeFn(ch):
+                return res
+            res = res + str(ch)
+        return res
+
+    def tokenize(self, buffer: str, terms=False) -> List[Token]:
+        context = TokenContext(buffer=buffer)
+        chunk = str(buffer)
+        while chunk and (
+            self.identify_constants(context)
+            or self.identify_alphas(context)
+            or self.identify_operators(context)
+        ):
+            chunk = context.buffer[context.index :]
+        context.tokens.append(Token("", TokenEOF))
+        return context.tokens
+
+
+def main(num_problems: int = 50, repeat: int = 5, chunks: int = 10):
+    texts = [
+        " + ".join([gen_simplify_multiple_terms(20)[0] for _ in range(chunks)])
+        for _ in range(num_problems)
+    ]
+    chars = sum([len(t) for t in texts])
+    print(f"{num_problems} problems, {chars / num_problems:.0f} chars on average")
+    for name, tokenizer in [
+        ("slicing", SlicingTokenizer()),
+        ("single-pass", Tokenizer()),
+    ]:
+        seconds = timeit.timeit(
+            lambda: [tokenizer.tokenize(t) for t in texts], number=repeat
+        )
+        per_problem = seconds / (repeat * num_problems) * 1e6
+        print(f"{name:<12} {per_problem:10.2f} us/problem")
+
+
+if __name__ == "__main__":
+    main(*[int(a) for a in sys.argv[1:]])
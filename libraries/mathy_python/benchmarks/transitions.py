@@ -0,0 +1,49 @@
+"""Micro-benchmark comparing `MathyEnv.get_state_transition` calls that build
+the observation, which is the default, with `searching=True` calls that only
+read the reward and step type like MCTS does, and don't build it.
+
+Run from the package folder with mathy installed (e.g. `pip install -e .`):
+
+    python benchmarks/transitions.py [num_problems] [repeat]
+"""
+import sys
+import timeit
+
+from mathy import MathyEnvProblemArgs
+from mathy.envs import PolySimplify
+from mathy.types import MathyEnvDifficulty
+from mathy.util import is_terminal_transition
+
+
+def main(num_problems: int = 100, repeat: int = 20):
+    env = PolySimplify()
+    args = MathyEnvProblemArgs(difficulty=MathyEnvDifficulty.hard)
+    states = [env.get_initial_state(args)[0] for _ in range(num_problems)]
+    # Match the rules once so both cases read the valid moves from the cache, and
+    # build one observation so that its one-time imports aren't measured
+    for state in states:
+        env.get_valid_moves(state)
+    env.state_to_observation(states[0])
+
+    def reward_only():
+        for state in states:
+            transition = env.get_state_transition(state, searching=True)
+            is_terminal_transition(transition)
+            transition.reward
+
+    def with_observation():
+        for state in states:
+            env.get_state_transition(state)
+
+    print(f"{num_problems} hard problems")
+    for name, fn in [
+        ("with observation", with_observation),
+        ("reward only", reward_only),
+    ]:
+        seconds = timeit.timeit(fn, number=repeat)
+        per_state = seconds / (repeat * num_problems) * 1e6
+        print(f"{name:<18} {per_state:8.2f} us/transition")
+
+
+if __name__ == "__main__":
+    main(*[int(a) for a in sys.argv[1:]])
@@ -0,0 +1,70 @@
+"""Micro-benchmark comparing recursive callback tree visits with the iterative
+generator traversals on generated "hard" polynomial problems.
+
+Run from the package folder with mathy installed (e.g. `pip install -e .`):
+
+    python benchmarks/traversal.py [num_problems] [repeat]
+"""
+import sys
+import timeit
+from typing import List
+
+from mathy import ExpressionParser, MathExpression, MathyEnvProblemArgs
+from mathy.core.tree import STOP
+from mathy.envs import PolySimplify
+from mathy.types import MathyEnvDifficulty
+
+
+def recursive_inorder(node, visit_fn, depth=0, data=None):
+    """The original recursive callback implementation of `visit_inorder`"""
+    if node.left and recursive_inorder(node.left, visit_fn, depth + 1, data) == STOP:
+        return STOP
+    if visit_fn and visit_fn(node, depth, data) == STOP:
+        return STOP
+    if node.right and recursive_inorder(node.right, visit_fn, depth + 1, data) == STOP:
+        return STOP
+
+
+def to_list_recursive(expression: MathExpression) -> List[MathExpression]:
+    results: List[MathExpression] = []
+
+    def visit_fn(node, depth, data):
+        return results.append(node)
+
+    recursive_inorder(expression, visit_fn)
+    return results
+
+
+def to_list_callback(expression: MathExpression) -> List[MathExpression]:
+    results: List[MathExpression] = []
+
+    def visit_fn(node, depth, data):
+        return results.append(node)
+
+    expression.visit_inorder(visit_fn)
+    return results
+
+
+def to_list_generator(expression: MathExpression) -> List[MathExpression]:
+    return list(expression.iter_inorder())
+
+
+def main(num_problems: int = 200, repeat: int = 20):
+    env = PolySimplify()
+    parser = ExpressionParser()
+    args = MathyEnvProblemArgs(difficulty=MathyEnvDifficulty.hard)
+    trees = [parser.parse(env.problem_fn(args).text) for _ in range(num_problems)]
+    nodes = sum([len(t.to_list()) for t in trees])
+    print(f"{num_problems} hard problems, {nodes / num_problems:.1f} nodes on average")
+    for name, fn in [
+        ("recursive callback", to_list_recursive),
+        ("iterative callback", to_list_callback),
+        ("iterative generator", to_list_generator),
+    ]:
+        seconds = timeit.timeit(lambda: [fn(t) for t in trees], number=repeat)
+        per_tree = seconds / (repeat * num_problems) * 1e6
+        print(f"{name:<20} {per_tree:8.2f} us/tree")
+
+
+if __name__ == "__main__":
+    main(*[int(a) for a in sys.argv[1:]])
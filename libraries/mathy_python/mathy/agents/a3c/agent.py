@@ -6,6 +6,7 @@ from typing import List
 import gym
 import numpy as np
 
+from ...core.parser import ExpressionParser
 from ...teacher import Teacher
 from ..policy_value_model import get_or_create_policy_model, PolicyValueModel
 from .config import A3CConfig
@@ -23,7 +24,11 @@ class A3CAgent:
         import tensorflow as tf
 
         self.args = args
-        self.env_extra = env_extra if env_extra is not None else {}
+        # Copy the options so adding the parser doesn't change the caller's dict
+        self.env_extra = dict(env_extra) if env_extra is not None else {}
+        # All the worker threads parse problems with one shared parser, so they
+        # share a warm process-wide parse cache.
+        self.env_extra.setdefault("parser", ExpressionParser())
         if self.args.verbose:
             print(f"Agent: {os.path.join(args.model_dir, args.model_name)}")
             print(f"Config: {json.dumps(self.args.dict(), indent=2)}")
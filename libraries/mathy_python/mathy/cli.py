@@ -102,18 +102,20 @@ def cli_print_problems(environment: str, difficulty: str, number: int):
         widths = (10, 8, 62)
         aligns = ("c", "c", "l")
         data = []
+        problems = []
         for i in range(number):
             state, problem = env.mathy.get_initial_state(
                 env.env_problem_args, print_problem=False
             )
-            valid = False
+            problems.append(problem)
+        results = env.mathy.parser.parse_many(
+            [problem.text for problem in problems], workers=None
+        )
+        for problem, result in zip(problems, results):
             text = problem.text
-            try:
-                env.mathy.parser.parse(problem.text)
-                valid = True
-            except BaseException as error:
-                text = f"parse failed for '{problem.text}' with error: {error}"
-            data.append((problem.complexity, "✔" if valid else "✘", text,))
+            if not result.ok:
+                text = f"parse failed for '{problem.text}' with error: {result.error}"
+            data.append((problem.complexity, "✔" if result.ok else "✘", text,))
     msg.good(f"\nGenerated {number} problems!")
 
     print(msg.table(data, header=header, divider=True, widths=widths, aligns=aligns))
@@ -1,4 +1,6 @@
+from .cache import *  # noqa
 from .expressions import *  # noqa
+from .flat import *  # noqa
 from .layout import *  # noqa
 from .parser import *  # noqa
 from .tokenizer import *  # noqa
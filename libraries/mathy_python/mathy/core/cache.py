@@ -0,0 +1,118 @@
+"""Caches
+---
+
+Bounded least-recently-used caches, used to avoid re-tokenizing and re-parsing
+the same problem text over and over.
+
+```python
+from mathy.core.cache import LRUCache
+
+cache = LRUCache(capacity=2)
+cache.put("a", 1)
+cache.put("b", 2)
+assert cache.get("a") == 1
+cache.put("c", 3)  # evicts "b", the least recently used key
+assert cache.get("b") is None
+assert cache.stats.evictions == 1
+```
+"""
+import threading
+from collections import OrderedDict
+from typing import Generic, NamedTuple, Optional, TypeVar
+
+KeyType = TypeVar("KeyType")
+ValueType = TypeVar("ValueType")
+
+
+class CacheStats(NamedTuple):
+    """A snapshot of the counters of an #LRUCache"""
+
+    hits: int
+    misses: int
+    evictions: int
+    size: int
+    capacity: int
+
+    @property
+    def hit_rate(self) -> float:
+        """The fraction of lookups that found a value, or 0.0 if there were none"""
+        total = self.hits + self.misses
+        return self.hits / total if total > 0 else 0.0
+
+
+class LRUCache(Generic[KeyType, ValueType]):
+    """A dictionary-like cache that holds at most `capacity` values, and evicts
+    the least recently used value when it is full.
+
+    A capacity of 0 disables caching, so every lookup is a miss. Counters for
+    hits, misses, and evictions are kept for tuning the capacity, and are only
+    reset by #LRUCache.reset_stats. All operations hold a lock, so a cache can
+    be shared between threads.
+    """
+
+    capacity: int
+    hits: int
+    misses: int
+    evictions: int
+
+    def __init__(self, capacity: int = 1024):
+        if capacity < 0:
+            raise ValueError(f"cache capacity must be >= 0, got: {capacity}")
+        self.capacity = capacity
+        self._values: "OrderedDict[KeyType, ValueType]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.reset_stats()
+
+    def __len__(self) -> int:
+        return len(self._values)
+
+    def __contains__(self, key: KeyType) -> bool:
+        return key in self._values
+
+    def get(
+        self, key: KeyType, default: Optional[ValueType] = None
+    ) -> Optional[ValueType]:
+        """Get the value for a key and mark it as the most recently used, or
+        return `default` if it is not in the cache."""
+        with self._lock:
+            value = self._values.get(key, None)
+            if value is None:
+                self.misses += 1
+                return default
+            self._values.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key: KeyType, value: ValueType) -> None:
+        """Store a value for a key, evicting the least recently used value if
+        the cache is full."""
+        if self.capacity == 0:
+            return
+        with self._lock:
+            self._values[key] = value
+            self._values.move_to_end(key)
+            while len(self._values) > self.capacity:
+                self._values.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self) -> None:
+        """Remove all values from the cache. The counters are not reset."""
+        with self._lock:
+            self._values.clear()
+
+    def reset_stats(self) -> None:
+        """Reset the hit, miss, and eviction counters to 0"""
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def stats(self) -> CacheStats:
+        """A snapshot of the cache counters"""
+        return CacheStats(
+            hits=self.hits,
+            misses=self.misses,
+            evictions=self.evictions,
+            size=len(self._values),
+            capacity=self.capacity,
+        )
@@ -1,10 +1,25 @@
+import hashlib
 import math
-from typing import Dict, List, Optional, Tuple, Type, Union, cast, TypeVar
+import struct
+import threading
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    List,
+    Optional,
+    Set,
+    Tuple,
+    Type,
+    TypeVar,
+    Union,
+    cast,
+)
 
 import numpy as np
 from colr import color
 
-from .tree import STOP, BinaryTreeNode
+from .tree import LEFT, BinaryTreeNode
 
 OOO_FUNCTION = 4
 OOO_PARENS = 3
@@ -64,6 +79,78 @@ MathTypeKeysMax = max(MathTypeKeys.values()) + 1
 
 NodeType = TypeVar("NodeType", bound="MathExpression")
 
+# Bits used in MathExpression.type_mask, assigned to classes as they are seen
+_type_bits: Dict[type, int] = {}
+# The combined bits of each class and its base classes
+_class_masks: Dict[type, int] = {}
+_type_bits_lock = threading.Lock()
+
+
+def _get_class_mask(node_class: type) -> int:
+    mask = _class_masks.get(node_class, None)
+    if mask is None:
+        with _type_bits_lock:
+            mask = 0
+            for base in node_class.__mro__:
+                if base not in _type_bits:
+                    _type_bits[base] = 1 << len(_type_bits)
+                mask |= _type_bits[base]
+            _class_masks[node_class] = mask
+    return mask
+
+
+def _combine_type_masks(node: "MathExpression", left: Any, right: Any) -> int:
+    mask = _get_class_mask(node.__class__)
+    if left is not None:
+        mask |= left
+    if right is not None:
+        mask |= right
+    return mask
+
+
+def _combine_sizes(node: "MathExpression", left: Any, right: Any) -> int:
+    return 1 + (left if left is not None else 0) + (right if right is not None else 0)
+
+
+_FINGERPRINT_NODE = struct.Struct("<BQQ")
+
+
+def _combine_fingerprints(node: "MathExpression", left: Any, right: Any) -> int:
+    # Hash an exact encoding of the node, rather than Python's hash() of its
+    # value, which is equal for different numbers (e.g. hash(-1) == hash(-2))
+    data = _FINGERPRINT_NODE.pack(
+        node.type_id,
+        left if left is not None else 0,
+        right if right is not None else 0,
+    )
+    digest = hashlib.blake2b(data + node.fingerprint_value(), digest_size=8)
+    return int.from_bytes(digest.digest(), "little")
+
+
+# Step types in the postfix programs built by MathExpression.compile
+_PUSH_CONSTANT = 0
+_PUSH_VARIABLE = 1
+_UNARY = 2
+_BINARY = 3
+
+
+def cache_text(
+    render_fn: Callable[["MathExpression"], str]
+) -> Callable[["MathExpression"], str]:
+    """Decorate a `__str__` method so that the text it renders is cached on the
+    node until the node or one of its children changes.
+
+    See #MathExpression.invalidate"""
+
+    def wrapper(self: "MathExpression") -> str:
+        text = self._str
+        if text is None:
+            text = self._str = render_fn(self)
+        return text
+
+    wrapper.__doc__ = render_fn.__doc__
+    return wrapper
+
 
 class MathExpression(BinaryTreeNode):
     """Math tree node with helpers for manipulating expressions.
@@ -90,12 +177,18 @@ class MathExpression(BinaryTreeNode):
         highlight which nodes have been changed in this tree as a result of
         a transformation."""
 
-        def visit_fn(node, depth, data):
-            node._rendering_change = data
-
-        self.visit_inorder(visit_fn, data=True)
+        nodes = self.to_list("inorder")
+        # Cached text doesn't include colors, so render everything from scratch,
+        # then put back the cached text so that the ancestors of this node still
+        # only have cached text when their children do (see #invalidate)
+        cached = [node._str for node in nodes]
+        for node in nodes:
+            node._rendering_change = True
+            node._str = None
         result = str(self)
-        self.visit_inorder(visit_fn, data=False)
+        for node, text in zip(nodes, cached):
+            node._rendering_change = False
+            node._str = text
         return result
 
     @property
@@ -103,11 +196,21 @@ class MathExpression(BinaryTreeNode):
         """Color to use for this node when rendering it as changed with `.terminal_text`"""
         return "green"
 
-    _rendering_change: bool
+    __slots__ = (
+        "_changed",
+        "_str",
+        "_fingerprint",
+        "_type_mask",
+        "_size",
+        "r_index",
+    )
+
     _changed: bool
-    classes: List[str]
-    cloned_node: Optional["MathExpression"]
-    cloned_target: str
+    _str: Optional[str]
+    _fingerprint: Optional[int]
+    _type_mask: Optional[int]
+    _size: Optional[int]
+    r_index: int
 
     def __init__(
         self,
@@ -116,12 +219,34 @@ class MathExpression(BinaryTreeNode):
         right: "MathExpression" = None,
         parent: "MathExpression" = None,
     ):
-        super().__init__(left, right, parent, id)
-        self._rendering_change = False
         self._changed = False
-        self.classes = [self.id]
-        self.cloned_node = None
-        self.cloned_target = ""
+        self._str = None
+        self._fingerprint = None
+        self._type_mask = None
+        self._size = None
+        super().__init__(left, right, parent, id)
+
+    @property
+    def classes(self) -> List[str]:
+        """The class names to attach to this node when it is rendered to an
+        output format like MathML. Defaults to the node's id."""
+        return self.get_extra("classes", [self.id])
+
+    @classes.setter
+    def classes(self, value: List[str]) -> None:
+        self.set_extra("classes", value)
+
+    @property
+    def _rendering_change(self) -> bool:
+        return self.get_extra("rendering_change", False)
+
+    @_rendering_change.setter
+    def _rendering_change(self, value: bool) -> None:
+        # Only store the flag while rendering, so nodes don't keep a side table
+        if value:
+            self.set_extra("rendering_change", value)
+        else:
+            self.pop_extra("rendering_change")
 
     def evaluate(
         self, context: Dict[str, Union[float, int]] = None
@@ -129,21 +254,270 @@ class MathExpression(BinaryTreeNode):
         """Evaluate the expression, resolving all variables to constant values"""
         raise NotImplementedError("must be implemented in subclass")
 
+    def compile(self) -> Callable[[Dict[str, Any]], np.ndarray]:
+        """Compile this expression into a function that evaluates it over arrays
+        of variable values with NumPy.
+
+        The expression is flattened into a postfix program with one step per
+        node, and each step operates on whole arrays, so evaluating hundreds of
+        points costs about the same as evaluating one. Division by zero gives
+        `nan`, the same as #MathExpression.evaluate.
+
+        `mathy:4x + 2`
+
+        ```python
+        import numpy as np
+        from mathy import ExpressionParser
+
+        fn = ExpressionParser().parse("4x + 2").compile()
+        assert fn({"x": np.array([1.0, 2.0, 3.0])}).tolist() == [6.0, 10.0, 14.0]
+        ```
+
+        # Returns
+        (Callable): A function that accepts a dict of variable values (arrays or
+            scalars) and returns an array of expression values
+        """
+        program: List[Tuple[int, Any]] = []
+        identifiers: Set[str] = set()
+        # Postorder visits children first, so their values are on the stack
+        # when their parent's step runs.
+        for node in self.iter_postorder():
+            if isinstance(node, ConstantExpression):
+                program.append((_PUSH_CONSTANT, float(node.value)))
+            elif isinstance(node, VariableExpression):
+                node._check()
+                identifiers.add(cast(str, node.identifier))
+                program.append((_PUSH_VARIABLE, node.identifier))
+            elif isinstance(node, UnaryExpression):
+                if node.get_child() is None:
+                    raise ValueError("cannot compile unary expression without a child")
+                program.append((_UNARY, node.array_operate))
+            elif isinstance(node, BinaryExpression):
+                node._check()
+                program.append((_BINARY, node.array_operate))
+            else:
+                raise ValueError(f"cannot compile node of type: {type(node)}")
+
+        def evaluate_arrays(context: Dict[str, Any]) -> np.ndarray:
+            values: Dict[str, np.ndarray] = {}
+            for identifier in identifiers:
+                value = context.get(identifier, None)
+                if value is None:
+                    raise ValueError(
+                        f"cannot evaluate statement with None variable: {identifier}"
+                    )
+                values[identifier] = np.asarray(value, dtype="float64")
+            stack: List[Any] = []
+            with np.errstate(all="ignore"):
+                for step, data in program:
+                    if step == _PUSH_CONSTANT:
+                        stack.append(data)
+                    elif step == _PUSH_VARIABLE:
+                        stack.append(values[data])
+                    elif step == _UNARY:
+                        stack[-1] = data(stack[-1])
+                    else:
+                        right = stack.pop()
+                        stack[-1] = data(stack[-1], right)
+            return np.asarray(stack[-1], dtype="float64")
+
+        return evaluate_arrays
+
     def set_changed(self) -> None:
         """Mark this node as having been changed by the application of a Rule"""
         self._changed = True
+        self.invalidate()
+
+    def invalidate(self) -> None:
+        """Clear the cached text, fingerprint, type mask, and size of this node
+        and all of its ancestors.
+
+        A node only caches a value after all of its children have cached theirs,
+        so the walk up the tree stops at the first ancestor that has nothing
+        cached."""
+        self._str = self._fingerprint = self._type_mask = self._size = None
+        node = self.parent
+        while node is not None and (
+            node._str is not None
+            or node._fingerprint is not None
+            or node._type_mask is not None
+            or node._size is not None
+        ):
+            node._str = node._fingerprint = node._type_mask = node._size = None
+            node = node.parent
+
+    @property
+    def fingerprint(self) -> int:
+        """A structural hash of this expression that combines the type, value,
+        and the fingerprints of the children of each node.
+
+        Expressions with the same structure have the same fingerprint, in any
+        process. Each node is hashed with BLAKE2 from an exact encoding of its
+        type, value, and the fingerprints of its children, so different
+        expressions only share a fingerprint by (64-bit) chance. Use
+        #MathExpression.to_bytes where an exact key is needed, or
+        #MathExpression.is_identical to confirm that two trees are the same.
+
+        Fingerprints are cached on each node and cleared when a subtree changes,
+        so after a rule rewrites part of a tree only the changed nodes and their
+        ancestors are hashed again.
+
+        `mathy:4x + 2`
+
+        ```python
+        from mathy import ExpressionParser
+
+        parser = ExpressionParser()
+        expression = parser.parse("4x + 2")
+        assert expression.fingerprint == parser.parse("4x + 2").fingerprint
+        assert expression.fingerprint != parser.parse("4x + 3").fingerprint
+        ```
+        """
+        if self._fingerprint is not None:
+            return self._fingerprint
+        return self._fill_subtree_cache("_fingerprint", _combine_fingerprints)
+
+    def fingerprint_value(self) -> bytes:
+        """The bytes that identify this node in its fingerprint, beyond its
+        type. Nodes that hold data, like constants, override this."""
+        return b""
+
+    def is_identical(self, other: "MathExpression") -> bool:
+        """Return True if `other` is exactly the same expression as this one:
+        the same types of nodes, in the same shape, with the same values.
+
+        Unlike comparing fingerprints this can't give a false positive, but it
+        walks both trees unless their fingerprints differ.
+
+        # Arguments
+        other (MathExpression): The expression to compare with
+
+        # Returns
+        (bool): True if the expressions are the same
+        """
+        if self is other:
+            return True
+        if self.fingerprint != other.fingerprint:
+            return False
+        stack: List[Tuple[MathExpression, MathExpression]] = [(self, other)]
+        while stack:
+            node, other_node = stack.pop()
+            if node is other_node:
+                continue
+            if (
+                type(node) is not type(other_node)
+                or node.fingerprint_value() != other_node.fingerprint_value()
+            ):
+                return False
+            for child, other_child in [
+                (node.left, other_node.left),
+                (node.right, other_node.right),
+            ]:
+                if child is None or other_child is None:
+                    if child is not other_child:
+                        return False
+                else:
+                    stack.append((child, other_child))
+        return True
+
+    @property
+    def type_mask(self) -> int:
+        """A bitmask of the expression types found in this subtree, including
+        their base classes. Cached and cleared the same way as the fingerprint.
+
+        See #MathExpression.contains_type"""
+        if self._type_mask is not None:
+            return self._type_mask
+        return self._fill_subtree_cache("_type_mask", _combine_type_masks)
+
+    def contains_type(self, instanceType: Type["MathExpression"]) -> bool:
+        """Return True if this node or any of its descendants is an instance of
+        the given type. After the first query this is answered without walking
+        the tree."""
+        mask = self.type_mask
+        bit = _type_bits.get(instanceType, None)
+        # Every class of the nodes in the tree is registered when its mask is
+        # computed, so an unregistered type can't be in it.
+        return bit is not None and mask & bit != 0
+
+    @property
+    def size(self) -> int:
+        """The number of nodes in this subtree. Cached and cleared the same way
+        as the fingerprint."""
+        if self._size is not None:
+            return self._size
+        return self._fill_subtree_cache("_size", _combine_sizes)
+
+    def get_node_at_index(self, index: int) -> Optional["MathExpression"]:
+        """Get the node at the given inorder index in this subtree, which is the
+        index that action token indices refer to. Uses the cached subtree sizes,
+        so it takes time proportional to the depth of the tree.
+
+        # Returns
+        (Optional[MathExpression]): The node, or None if the index is out of range
+        """
+        if index < 0 or index >= self.size:
+            return None
+        node = self
+        while True:
+            left_size = node.left._size if node.left is not None else 0
+            if index < left_size:  # type:ignore
+                node = node.left  # type:ignore
+            elif index == left_size:
+                return node
+            else:
+                index -= left_size + 1  # type:ignore
+                node = node.right  # type:ignore
+
+    def get_inorder_index(self) -> int:
+        """Get the inorder index of this node within its whole tree, the same
+        value that #BaseRule.find_nodes stores in `r_index`. Takes time
+        proportional to the depth of the node."""
+        index = self.left.size if self.left is not None else 0
+        node = self
+        parent = node.parent
+        while parent is not None:
+            if parent.right is node:
+                index += 1 + (parent.left.size if parent.left is not None else 0)
+            node = parent
+            parent = node.parent
+        return index
+
+    def _fill_subtree_cache(
+        self,
+        slot: str,
+        combine: Callable[["MathExpression", Any, Any], Any],
+    ) -> Any:
+        """Compute a cached value for each node of this subtree that doesn't have
+        one, from the node and the values of its children.
+
+        Nodes are visited bottom-up with an explicit stack, and subtrees that
+        already have a value are skipped."""
+        stack: List[MathExpression] = [self]
+        while stack:
+            node = stack[-1]
+            left = node.left
+            right = node.right
+            left_value = getattr(left, slot) if left is not None else None
+            if left is not None and left_value is None:
+                stack.append(left)
+                continue
+            right_value = getattr(right, slot) if right is not None else None
+            if right is not None and right_value is None:
+                stack.append(right)
+                continue
+            stack.pop()
+            setattr(node, slot, combine(node, left_value, right_value))
+        return getattr(self, slot)
 
     def all_changed(self) -> None:
         """Mark this node and all of its children as changed"""
-
-        def visit_fn(node, depth, data):
+        for node in self.iter_inorder():
             node.set_changed()
 
-        self.visit_inorder(visit_fn)
-
     def with_color(self, text: str, style="bright") -> str:
         """Render a string that is colored if something has changed"""
-        if self._rendering_change is True and self._changed is True:
+        if self._changed is True and self._rendering_change is True:
             return color(text, fore=self.color, style=style)
         return text
 
@@ -160,29 +534,19 @@ class MathExpression(BinaryTreeNode):
 
     def to_list(self, visit: str = "preorder") -> List["MathExpression"]:
         """Convert this node hierarchy into a list."""
-        results = []
-
-        def visit_fn(node, depth, data):
-            return results.append(node)
-
         if visit == "inorder":
-            self.visit_inorder(visit_fn)
+            return list(self.iter_inorder())
         elif visit == "preorder":
-            self.visit_preorder(visit_fn)
+            return list(self.iter_preorder())
         elif visit == "postorder":
-            self.visit_postorder(visit_fn)
-        else:
-            raise ValueError(f"invalid visit order: {visit}")
-        return results
+            return list(self.iter_postorder())
+        raise ValueError(f"invalid visit order: {visit}")
 
     def clear_classes(self) -> None:
         """Clear all the classes currently set on the nodes in this expression."""
-
-        def visit_fn(node, depth, data):
+        for node in self.iter_inorder():
             node.classes = []
 
-        self.visit_inorder(visit_fn)
-
     def find_type(self, instanceType: Type[NodeType]) -> List[NodeType]:
         """Find an expression in this tree by type.
 
@@ -190,13 +554,24 @@ class MathExpression(BinaryTreeNode):
         
         Returns the found #MathExpression objects of the given type.
         """
-        results = []
-
-        def visit_fn(node, depth, data):
+        mask = self.type_mask
+        bit = _type_bits.get(instanceType, None)
+        if bit is None or mask & bit == 0:
+            return []
+        # Walk the tree inorder, skipping subtrees that can't contain the type
+        results: List[NodeType] = []
+        stack: List[MathExpression] = []
+        node: Optional[MathExpression] = self
+        while True:
+            while node is not None and node._type_mask & bit:  # type:ignore
+                stack.append(node)
+                node = node.left
+            if not stack:
+                break
+            node = stack.pop()
             if isinstance(node, instanceType):
-                return results.append(node)
-
-        self.visit_inorder(visit_fn)
+                results.append(node)
+            node = node.right
         return results
 
     def find_id(self, id: str) -> Optional["MathExpression"]:
@@ -204,16 +579,11 @@ class MathExpression(BinaryTreeNode):
 
         Returns: The found #MathExpression or `None`
         """
-        result: Optional[MathExpression] = None
-
-        def visit_fn(node, depth, data):
-            nonlocal result
-            if node.id == id:
-                result = node
-                return STOP
-
-        self.visit_inorder(visit_fn)
-        return result
+        for node in self.iter_inorder():
+            # Nodes without an allocated id can't match one handed out before
+            if node._id == id:
+                return node
+        return None
 
     def to_math_ml_fragment(self) -> str:
         """Convert this single node into MathML."""
@@ -266,6 +636,10 @@ class MathExpression(BinaryTreeNode):
         is useful when you want to clone a subtree and still maintain the overall
         hierarchy.
 
+        The node is located in the cloned tree by following the same left/right
+        path that leads from the root to the node, so the whole operation is
+        linear in the size of the tree.
+
         # Arguments
         node (MathExpression): The node to clone.
 
@@ -273,35 +647,51 @@ class MathExpression(BinaryTreeNode):
         (MathExpression): The cloned node.
         """
         node = node if node is not None else self
-        self.cloned_node = None
-        self.cloned_target = node.path_to_root()
-        result = node.get_root().clone()
-        if not self.cloned_node:  # pragma: nocover
-            print("While cloning root of: {}".format(node))
-            print(" Which is this       : {}".format(node.get_root()))
-            print("Did not set the clone: {}".format(self.cloned_node))
-            raise Exception("cloning root hierarchy did not clone this node")
-
-        result = self.cloned_node
-        self.cloned_node = None
-        self.cloned_target = None
+        sides: List[str] = []
+        current: MathExpression = node
+        while current.parent is not None:
+            sides.append(current.parent.get_side(current))
+            current = current.parent
+        result = current.clone()
+        for side in reversed(sides):
+            child = result.left if side == LEFT else result.right
+            if child is None:  # pragma: nocover
+                raise ValueError("cloning root hierarchy did not clone this node")
+            result = child
         return result
 
-    def clone(self) -> "MathExpression":
-        """A specialization of the clone method that can track and report a cloned
-        subtree node. 
-        
-        See #MathExpression.clone_from_root for more details."""
-        result = super().clone()
-        if self.cloned_target is not None and self.path_to_root() == self.cloned_target:
-            self.cloned_node = result
+    def to_bytes(self) -> bytes:
+        """Encode this expression as compact bytes that can be decoded with
+        #MathExpression.from_bytes without tokenizing or parsing text.
 
-        return result
+        The encoding is a stream with one code per node in preorder. Operators
+        and single letter lowercase variables take one byte, as do integer
+        constants from -64 to 63. Other constants and identifiers follow their
+        code. Node ids, colors, and classes are not encoded.
+
+        # Returns
+        (bytes): The encoded expression
+        """
+        return _encode_expression(self)
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "MathExpression":
+        """Decode an expression from the output of #MathExpression.to_bytes
+
+        # Arguments
+        data (bytes): The encoded expression
+
+        # Returns
+        (MathExpression): The root node of the decoded expression tree
+        """
+        return _decode_expression(data)
 
 
 class UnaryExpression(MathExpression):
     """An expression that operates on one sub-expression"""
 
+    __slots__ = ("child", "left_child")
+
     def __init__(self, child: MathExpression = None, child_on_left: bool = True):
         super().__init__()
         self.child = child
@@ -329,6 +719,11 @@ class UnaryExpression(MathExpression):
     def operate(self, value: Union[float, int]) -> Union[float, int]:
         raise NotImplementedError("Must be implemented in subclass")
 
+    def array_operate(self, value: np.ndarray) -> np.ndarray:
+        """Apply `operate` to an array of values. Used by #MathExpression.compile,
+        and overridden by nodes whose `operate` only works on single values."""
+        return self.operate(value)  # type:ignore
+
 
 # ### Negation
 
@@ -336,6 +731,8 @@ class UnaryExpression(MathExpression):
 class NegateExpression(UnaryExpression):
     """Negate an expression, e.g. `4` becomes `-4`"""
 
+    __slots__ = ()
+
     @property
     def type_id(self) -> int:
         return MathTypeKeys["negate"]
@@ -347,6 +744,7 @@ class NegateExpression(UnaryExpression):
     def operate(self, value: Union[float, int]) -> Union[float, int]:
         return -value
 
+    @cache_text
     def __str__(self) -> str:
         return self.with_color("-{}".format(self.get_child()))
 
@@ -363,12 +761,15 @@ class FunctionExpression(UnaryExpression):
     text (used by the parser and tokenizer) is derived from the name() method on the
     class."""
 
+    __slots__ = ()
+
     @property
     def name(self) -> str:
         raise NotImplementedError(
             "Must be implemented in subclass. Function is an abstract node"
         )
 
+    @cache_text
     def __str__(self) -> str:
         child = self.get_child()
         output = self.name
@@ -383,6 +784,8 @@ class FunctionExpression(UnaryExpression):
 class BinaryExpression(MathExpression):
     """An expression that operates on two sub-expressions"""
 
+    __slots__ = ()
+
     def __init__(self, left=None, right=None):
         super().__init__(left=left, right=right)
 
@@ -404,6 +807,11 @@ class BinaryExpression(MathExpression):
     ) -> Union[float, int]:
         raise NotImplementedError("Must be implemented in subclass")
 
+    def array_operate(self, one: np.ndarray, two: np.ndarray) -> np.ndarray:
+        """Apply `operate` to arrays of values. Used by #MathExpression.compile,
+        and overridden by nodes whose `operate` only works on single values."""
+        return self.operate(one, two)  # type:ignore
+
     def _check(self) -> Tuple[MathExpression, MathExpression]:
         if self.left is None or self.right is None:
             raise ValueError(
@@ -466,6 +874,7 @@ class BinaryExpression(MathExpression):
                 return True
         return False
 
+    @cache_text
     def __str__(self) -> str:
         self._check()
         out = f"{self.left} {self.with_color(self.name)} {self.right}"
@@ -491,6 +900,8 @@ class BinaryExpression(MathExpression):
 class EqualExpression(BinaryExpression):
     """Evaluate equality of two expressions"""
 
+    __slots__ = ()
+
     @property
     def type_id(self) -> int:
         return MathTypeKeys["equal"]
@@ -515,6 +926,8 @@ class EqualExpression(BinaryExpression):
 class AddExpression(BinaryExpression):
     """Add one and two"""
 
+    __slots__ = ()
+
     @property
     def type_id(self) -> int:
         return MathTypeKeys["add"]
@@ -532,6 +945,8 @@ class AddExpression(BinaryExpression):
 class SubtractExpression(BinaryExpression):
     """Subtract one from two"""
 
+    __slots__ = ()
+
     @property
     def type_id(self) -> int:
         return MathTypeKeys["subtract"]
@@ -549,6 +964,8 @@ class SubtractExpression(BinaryExpression):
 class MultiplyExpression(BinaryExpression):
     """Multiply one and two"""
 
+    __slots__ = ()
+
     @property
     def type_id(self) -> int:
         return MathTypeKeys["multiply"]
@@ -565,6 +982,7 @@ class MultiplyExpression(BinaryExpression):
     ) -> Union[float, int]:
         return one * two
 
+    @cache_text
     def __str__(self) -> str:
         """Multiplication special cases constant*variable to output `4x` instead of
         `4 * x`"""
@@ -596,6 +1014,8 @@ class MultiplyExpression(BinaryExpression):
 class DivideExpression(BinaryExpression):
     """Divide one by two"""
 
+    __slots__ = ()
+
     @property
     def type_id(self) -> int:
         return MathTypeKeys["divide"]
@@ -621,10 +1041,15 @@ class DivideExpression(BinaryExpression):
         else:
             return one / two
 
+    def array_operate(self, one: np.ndarray, two: np.ndarray) -> np.ndarray:
+        return np.where(two == 0, np.nan, np.true_divide(one, two))
+
 
 class PowerExpression(BinaryExpression):
     """Raise one to the power of two"""
 
+    __slots__ = ()
+
     @property
     def type_id(self) -> int:
         return MathTypeKeys["power"]
@@ -648,6 +1073,7 @@ class PowerExpression(BinaryExpression):
     ) -> Union[float, int]:
         return np.power(one, two)
 
+    @cache_text
     def __str__(self):
         return "{}{}{}".format(self.left, self.with_color(self.name), self.right)
 
@@ -655,7 +1081,9 @@ class PowerExpression(BinaryExpression):
 class ConstantExpression(MathExpression):
     """A Constant value node, where the value is accessible as `node.value`"""
 
-    value: Union[float, int]
+    __slots__ = ("_value",)
+
+    _value: Union[float, int]
 
     @property
     def name(self):
@@ -669,7 +1097,17 @@ class ConstantExpression(MathExpression):
 
     def __init__(self, value=None):
         super().__init__()
-        self.value = value
+        self._value = value
+
+    @property
+    def value(self) -> Union[float, int]:
+        return self._value
+
+    @value.setter
+    def value(self, value: Union[float, int]) -> None:
+        self.check_mutable()
+        self._value = value
+        self.invalidate()
 
     def clone(self):
         result = super().clone()
@@ -679,6 +1117,13 @@ class ConstantExpression(MathExpression):
     def evaluate(self, context: Dict[str, Union[float, int]] = None):
         return self.value
 
+    def fingerprint_value(self) -> bytes:
+        value = self._value
+        if isinstance(value, (int, np.integer)):
+            return b"i" + str(int(value)).encode("ascii")
+        return b"f" + _FLOAT64.pack(float(value))
+
+    @cache_text
     def __str__(self) -> str:
         return self.with_color(self.name)
 
@@ -687,7 +1132,9 @@ class ConstantExpression(MathExpression):
 
 
 class VariableExpression(MathExpression):
-    identifier: Optional[str]
+    __slots__ = ("_identifier",)
+
+    _identifier: Optional[str]
 
     @property
     def name(self) -> str:
@@ -700,7 +1147,17 @@ class VariableExpression(MathExpression):
 
     def __init__(self, identifier: str = None):
         super().__init__()
-        self.identifier = identifier
+        self._identifier = identifier
+
+    @property
+    def identifier(self) -> Optional[str]:
+        return self._identifier
+
+    @identifier.setter
+    def identifier(self, identifier: Optional[str]) -> None:
+        self.check_mutable()
+        self._identifier = identifier
+        self.invalidate()
 
     def clone(self) -> "VariableExpression":
         result = cast(VariableExpression, super().clone())
@@ -711,6 +1168,13 @@ class VariableExpression(MathExpression):
         if self.identifier is None:
             raise ValueError("identifier must be a letter")
 
+    def fingerprint_value(self) -> bytes:
+        identifier = self._identifier
+        if identifier is None:
+            return b""
+        return identifier.encode("utf8")
+
+    @cache_text
     def __str__(self) -> str:
         self._check()
         return self.with_color("{}".format(self.identifier))
@@ -733,6 +1197,8 @@ class VariableExpression(MathExpression):
 class AbsExpression(FunctionExpression):
     """Evaluates the absolute value of an expression."""
 
+    __slots__ = ()
+
     @property
     def type_id(self) -> int:
         return MathTypeKeys["abs"]
@@ -746,6 +1212,8 @@ class AbsExpression(FunctionExpression):
 
 
 class SgnExpression(FunctionExpression):
+    __slots__ = ()
+
     @property
     def type_id(self):
         return MathTypeKeys["sgn"]
@@ -766,3 +1234,243 @@ class SgnExpression(FunctionExpression):
             return 1
 
         return 0
+
+    def array_operate(self, value: np.ndarray) -> np.ndarray:
+        # operate returns 0 for nan values, where np.sign would return nan
+        return np.where(np.isnan(value), 0.0, np.sign(value))
+
+
+# ## Binary Encoding
+#
+# See #MathExpression.to_bytes. Codes below 0x40 are the type ids of operators
+# and lowercase variables, and unary operators with their child on the right
+# add 0x40 to their type id. Integer constants from -64 to 63 are stored in
+# the code itself, as value + 0xC0. Float constants with a few decimal places
+# (e.g. 3.5) are stored as an integer and a power of 10 to divide it by, which
+# is added to the code.
+
+_BYTES_VERSION = 1
+_UNARY_RIGHT = 0x40
+_CODE_DECIMAL16 = 0x60
+_CODE_DECIMAL32 = 0x68
+_MAX_DECIMAL_PLACES = 6
+_CODE_INT16 = 0x6F
+_CODE_INT32 = 0x70
+_CODE_INT64 = 0x71
+_CODE_FLOAT64 = 0x72
+_CODE_BIG_INT = 0x73
+_CODE_IDENTIFIER = 0x74
+_CODE_NO_IDENTIFIER = 0x75
+_SMALL_INT_BASE = 0xC0
+_INT16 = struct.Struct("<h")
+_INT32 = struct.Struct("<i")
+_INT64 = struct.Struct("<q")
+_FLOAT64 = struct.Struct("<d")
+
+# Map of the node classes that can be encoded to their type ids
+_ENCODE_TYPE_IDS: Dict[type, int] = {
+    NegateExpression: MathTypeKeys["negate"],
+    EqualExpression: MathTypeKeys["equal"],
+    AddExpression: MathTypeKeys["add"],
+    SubtractExpression: MathTypeKeys["subtract"],
+    MultiplyExpression: MathTypeKeys["multiply"],
+    DivideExpression: MathTypeKeys["divide"],
+    PowerExpression: MathTypeKeys["power"],
+    SgnExpression: MathTypeKeys["sgn"],
+    AbsExpression: MathTypeKeys["abs"],
+}
+# Lowercase single letter identifiers are encoded as their variable type id
+_LETTER_CODES: Dict[str, int] = {
+    chr(c): MathTypeKeys[f"variable_{chr(c)}"] for c in range(ord("a"), ord("z") + 1)
+}
+# The number of children that each type of step has
+_STEP_CHILDREN = {_PUSH_CONSTANT: 0, _PUSH_VARIABLE: 0, _UNARY: 1, _BINARY: 2}
+# Map of the codes that have no extra bytes to the steps they decode to
+_FIXED_CODE_STEPS: Dict[int, Tuple[int, Any]] = {
+    _CODE_NO_IDENTIFIER: (_PUSH_VARIABLE, None)
+}
+for _value in range(-64, 64):
+    _FIXED_CODE_STEPS[_value + _SMALL_INT_BASE] = (_PUSH_CONSTANT, _value)
+for _letter, _code in _LETTER_CODES.items():
+    _FIXED_CODE_STEPS[_code] = (_PUSH_VARIABLE, _letter)
+for _class, _code in _ENCODE_TYPE_IDS.items():
+    if issubclass(_class, UnaryExpression):
+        _FIXED_CODE_STEPS[_code] = (_UNARY, (_class, True))
+        _FIXED_CODE_STEPS[_code | _UNARY_RIGHT] = (_UNARY, (_class, False))
+    else:
+        _FIXED_CODE_STEPS[_code] = (_BINARY, _class)
+
+
+def _encode_float(out: bytearray, value: float) -> None:
+    # Negative zero would be decoded as zero, so it's stored as a float64
+    negative_zero = value == 0.0 and math.copysign(1.0, value) < 0
+    if math.isfinite(value) and abs(value) < 2 ** 31 and not negative_zero:
+        for places in range(_MAX_DECIMAL_PLACES + 1):
+            scale = 10 ** places
+            scaled = round(value * scale)
+            if scaled / scale != value:
+                continue
+            if -(2 ** 15) <= scaled < 2 ** 15:
+                out.append(_CODE_DECIMAL16 + places)
+                out += _INT16.pack(scaled)
+                return
+            if -(2 ** 31) <= scaled < 2 ** 31:
+                out.append(_CODE_DECIMAL32 + places)
+                out += _INT32.pack(scaled)
+                return
+            break
+    out.append(_CODE_FLOAT64)
+    out += _FLOAT64.pack(value)
+
+
+def _encode_expression(expression: MathExpression) -> bytes:
+    out = bytearray((_BYTES_VERSION,))
+    stack: List[MathExpression] = [expression]
+    while stack:
+        node = stack.pop()
+        node_class = type(node)
+        if node_class is ConstantExpression:
+            value = node.value  # type:ignore
+            if isinstance(value, (int, np.integer)) and not isinstance(value, bool):
+                value = int(value)
+                if -64 <= value < 64:
+                    out.append(value + _SMALL_INT_BASE)
+                elif -(2 ** 15) <= value < 2 ** 15:
+                    out.append(_CODE_INT16)
+                    out += _INT16.pack(value)
+                elif -(2 ** 31) <= value < 2 ** 31:
+                    out.append(_CODE_INT32)
+                    out += _INT32.pack(value)
+                elif -(2 ** 63) <= value < 2 ** 63:
+                    out.append(_CODE_INT64)
+                    out += _INT64.pack(value)
+                else:
+                    digits = str(value).encode("ascii")
+                    out.append(_CODE_BIG_INT)
+                    out.append(len(digits))
+                    out += digits
+            elif isinstance(value, (float, np.floating)):
+                _encode_float(out, float(value))
+            else:
+                raise ValueError(f"cannot encode constant value: {value}")
+        elif node_class is VariableExpression:
+            identifier = node.identifier  # type:ignore
+            code = _LETTER_CODES.get(identifier, None)
+            if code is not None:
+                out.append(code)
+            elif identifier is None:
+                out.append(_CODE_NO_IDENTIFIER)
+            else:
+                encoded = identifier.encode("utf8")
+                if len(encoded) > 255:
+                    raise ValueError(f"identifier is too long to encode: {identifier}")
+                out.append(_CODE_IDENTIFIER)
+                out.append(len(encoded))
+                out += encoded
+        else:
+            type_id = _ENCODE_TYPE_IDS.get(node_class, None)
+            if type_id is None:
+                raise ValueError(f"cannot encode node type: {node_class.__name__}")
+            if isinstance(node, UnaryExpression):
+                child = node.get_child()
+                if child is None:
+                    raise ValueError(
+                        f"cannot encode {node_class.__name__} with no child"
+                    )
+                out.append(type_id if node.left_child else type_id | _UNARY_RIGHT)
+                stack.append(child)
+            else:
+                if node.left is None or node.right is None:
+                    raise ValueError(
+                        f"cannot encode {node_class.__name__} with a missing child"
+                    )
+                out.append(type_id)
+                # Push right first so the left child is encoded first (preorder)
+                stack.append(node.right)
+                stack.append(node.left)
+    return bytes(out)
+
+
+def _decode_expression(data: bytes) -> MathExpression:
+    if len(data) < 2 or data[0] != _BYTES_VERSION:
+        raise ValueError("data is not an encoded expression")
+    # Read the codes into a list of steps like the ones built by compile
+    steps: List[Tuple[int, Any]] = []
+    index = 1
+    length = len(data)
+    # The number of nodes that are still expected to complete the tree
+    expected = 1
+    try:
+        while expected > 0:
+            code = data[index]
+            index += 1
+            step = _FIXED_CODE_STEPS.get(code, None)
+            if step is None:
+                step = (_PUSH_CONSTANT, None)
+                if _CODE_DECIMAL16 <= code <= _CODE_DECIMAL16 + _MAX_DECIMAL_PLACES:
+                    value = _INT16.unpack_from(data, index)[0]
+                    step = (_PUSH_CONSTANT, value / 10 ** (code - _CODE_DECIMAL16))
+                    index += 2
+                elif _CODE_DECIMAL32 <= code <= _CODE_DECIMAL32 + _MAX_DECIMAL_PLACES:
+                    value = _INT32.unpack_from(data, index)[0]
+                    step = (_PUSH_CONSTANT, value / 10 ** (code - _CODE_DECIMAL32))
+                    index += 4
+                elif code == _CODE_INT16:
+                    step = (_PUSH_CONSTANT, _INT16.unpack_from(data, index)[0])
+                    index += 2
+                elif code == _CODE_INT32:
+                    step = (_PUSH_CONSTANT, _INT32.unpack_from(data, index)[0])
+                    index += 4
+                elif code == _CODE_INT64:
+                    step = (_PUSH_CONSTANT, _INT64.unpack_from(data, index)[0])
+                    index += 8
+                elif code == _CODE_FLOAT64:
+                    step = (_PUSH_CONSTANT, _FLOAT64.unpack_from(data, index)[0])
+                    index += 8
+                elif code == _CODE_BIG_INT or code == _CODE_IDENTIFIER:
+                    end = index + 1 + data[index]
+                    if end > length:
+                        raise IndexError()
+                    text = data[index + 1 : end].decode("utf8")
+                    if code == _CODE_BIG_INT:
+                        step = (_PUSH_CONSTANT, int(text))
+                    else:
+                        step = (_PUSH_VARIABLE, text)
+                    index = end
+                else:
+                    raise ValueError(f"unknown code {code} at offset {index - 1}")
+            expected += _STEP_CHILDREN[step[0]] - 1
+            steps.append(step)
+    except (IndexError, struct.error):
+        raise ValueError("encoded expression is truncated")
+    if index != length:
+        raise ValueError(f"{length - index} trailing bytes after encoded expression")
+
+    # Build the tree from the leaves up by walking the steps in reverse, so the
+    # children of each node are already on the stack (top is the left child.)
+    # Children are linked directly rather than with set_left/set_right, because
+    # none of the new nodes have cached values that would need to be cleared.
+    stack: List[MathExpression] = []
+    node: MathExpression
+    for step_type, payload in reversed(steps):
+        if step_type == _PUSH_CONSTANT:
+            stack.append(ConstantExpression(payload))
+        elif step_type == _PUSH_VARIABLE:
+            stack.append(VariableExpression(payload))
+        elif step_type == _BINARY:
+            node = payload()
+            left = node.left = stack.pop()
+            right = node.right = stack[-1]
+            left.parent = right.parent = node
+            stack[-1] = node
+        else:
+            node_class, child_on_left = payload
+            node = node_class(child_on_left=child_on_left)
+            child = node.child = stack[-1]
+            if child_on_left:
+                node.left = child
+            else:
+                node.right = child
+            child.parent = node
+            stack[-1] = node
+    return stack[0]
@@ -0,0 +1,287 @@
+"""Flat Trees
+---
+
+Expression trees are made of Python objects linked together through their
+`left`, `right`, and `parent` attributes. That is convenient for rules that
+rewrite trees, but walking the objects is slow when all you need is a summary
+of the tree, like the features of an observation.
+
+A #FlatTree stores the same tree as a set of parallel NumPy arrays, with one
+entry per node in **preorder** (the same order used by #MathExpression.to_list).
+Child and parent links are stored as indices into the arrays, with `-1`
+indicating that there is no node. Constant values and variable identifiers are
+kept exactly in tables that the arrays index into.
+
+`mathy:4x + 2`
+
+```python
+from mathy import ExpressionParser, FlatTree
+
+expression = ExpressionParser().parse("4x + 2")
+flat = FlatTree.from_expression(expression)
+assert flat.type_id.tolist() == [3, 5, 10, 50, 10]
+assert str(flat.to_expression()) == "4x + 2"
+```
+"""
+from typing import Dict, List, Optional, Tuple, Type, Union
+
+import numpy as np
+
+from .expressions import (
+    AbsExpression,
+    AddExpression,
+    BinaryExpression,
+    ConstantExpression,
+    DivideExpression,
+    EqualExpression,
+    MathExpression,
+    MathTypeKeys,
+    MultiplyExpression,
+    NegateExpression,
+    PowerExpression,
+    SgnExpression,
+    SubtractExpression,
+    UnaryExpression,
+    VariableExpression,
+)
+from .tree import LEFT, RIGHT
+
+# Index value used for missing left/right/parent links.
+NO_NODE = -1
+
+# Map of type ids to the expression classes that they are created from.
+TypeIdClasses: Dict[int, Type[MathExpression]] = {
+    MathTypeKeys["negate"]: NegateExpression,
+    MathTypeKeys["equal"]: EqualExpression,
+    MathTypeKeys["add"]: AddExpression,
+    MathTypeKeys["subtract"]: SubtractExpression,
+    MathTypeKeys["multiply"]: MultiplyExpression,
+    MathTypeKeys["divide"]: DivideExpression,
+    MathTypeKeys["power"]: PowerExpression,
+    MathTypeKeys["constant"]: ConstantExpression,
+    MathTypeKeys["sgn"]: SgnExpression,
+    MathTypeKeys["abs"]: AbsExpression,
+}
+for _key, _value in MathTypeKeys.items():
+    if _key.startswith("variable"):
+        TypeIdClasses[_value] = VariableExpression
+
+
+class FlatTree:
+    """A struct-of-arrays representation of an expression tree.
+
+    All arrays have one entry per node, stored in preorder:
+
+    - `type_id` (uint8): the node's #MathExpression.type_id
+    - `left` (int32): the index of the left child or `-1`
+    - `right` (int32): the index of the right child or `-1`
+    - `parent` (int32): the index of the parent node or `-1`
+    - `value` (float64): the value of constant nodes as a float (for model
+      features), `0.0` for all others
+    - `constant` (int32): the index of constant values in `constants`, `-1`
+      for all other nodes
+    - `symbol` (int32): the index of variable identifiers in `symbols`, `-1`
+      for variables without one and all other nodes
+
+    The `constants` table holds the exact value of each constant node (in
+    preorder), and `symbols` holds each distinct variable identifier once.
+
+    Conversions in both directions preserve the tree structure, node types,
+    variable identifiers, and constant values (including their int or float
+    type). Node ids are not stored, and rebuilt nodes get new ids.
+    """
+
+    type_id: np.ndarray
+    left: np.ndarray
+    right: np.ndarray
+    parent: np.ndarray
+    value: np.ndarray
+    constant: np.ndarray
+    symbol: np.ndarray
+    constants: List[Union[int, float]]
+    symbols: List[str]
+
+    def __init__(
+        self,
+        type_id: np.ndarray,
+        left: np.ndarray,
+        right: np.ndarray,
+        parent: np.ndarray,
+        value: np.ndarray,
+        constant: np.ndarray,
+        symbol: np.ndarray,
+        constants: List[Union[int, float]],
+        symbols: List[str],
+    ):
+        self.type_id = type_id
+        self.left = left
+        self.right = right
+        self.parent = parent
+        self.value = value
+        self.constant = constant
+        self.symbol = symbol
+        self.constants = constants
+        self.symbols = symbols
+
+    def __len__(self) -> int:
+        return len(self.type_id)
+
+    @classmethod
+    def from_expression(cls, expression: MathExpression) -> "FlatTree":
+        """Convert an expression tree into a flat tree.
+
+        # Arguments
+        expression (MathExpression): The root of the tree to convert.
+
+        # Returns
+        (FlatTree): The flat tree with one entry per node in `expression`
+        """
+        type_ids: List[int] = []
+        lefts: List[int] = []
+        rights: List[int] = []
+        parents: List[int] = []
+        values: List[float] = []
+        constant_indices: List[int] = []
+        symbol_indices: List[int] = []
+        constants: List[Union[int, float]] = []
+        symbols: Dict[str, int] = {}
+        # Walk the tree with an explicit stack of (node, parent index, side)
+        # so that deep trees don't run into recursion limits.
+        stack: List[Tuple[MathExpression, int, Optional[str]]] = [
+            (expression, NO_NODE, None)
+        ]
+        while stack:
+            node, parent_index, side = stack.pop()
+            index = len(type_ids)
+            if side == LEFT:
+                lefts[parent_index] = index
+            elif side == RIGHT:
+                rights[parent_index] = index
+            type_ids.append(node.type_id)
+            lefts.append(NO_NODE)
+            rights.append(NO_NODE)
+            parents.append(parent_index)
+            if isinstance(node, ConstantExpression):
+                values.append(float(node.value))
+                constant_indices.append(len(constants))
+                constants.append(node.value)
+                symbol_indices.append(NO_NODE)
+            else:
+                values.append(0.0)
+                constant_indices.append(NO_NODE)
+                identifier = (
+                    node.identifier if isinstance(node, VariableExpression) else None
+                )
+                if identifier is None:
+                    symbol_indices.append(NO_NODE)
+                else:
+                    symbol_indices.append(symbols.setdefault(identifier, len(symbols)))
+            # Push right first so the left child is visited first (preorder)
+            if node.right is not None:
+                stack.append((node.right, index, RIGHT))
+            if node.left is not None:
+                stack.append((node.left, index, LEFT))
+
+        return FlatTree(
+            type_id=np.array(type_ids, dtype="uint8"),
+            left=np.array(lefts, dtype="int32"),
+            right=np.array(rights, dtype="int32"),
+            parent=np.array(parents, dtype="int32"),
+            value=np.array(values, dtype="float64"),
+            constant=np.array(constant_indices, dtype="int32"),
+            symbol=np.array(symbol_indices, dtype="int32"),
+            constants=constants,
+            symbols=list(symbols),
+        )
+
+    def to_expression(self) -> MathExpression:
+        """Convert this flat tree back into an expression tree.
+
+        # Returns
+        (MathExpression): The root node of the rebuilt expression tree
+        """
+        count = len(self.type_id)
+        if count == 0:
+            raise ValueError("cannot convert an empty flat tree to an expression")
+        type_ids = self.type_id.tolist()
+        lefts = self.left.tolist()
+        rights = self.right.tolist()
+        constant_indices = self.constant.tolist()
+        symbol_indices = self.symbol.tolist()
+        nodes: List[Optional[MathExpression]] = [None] * count
+        # Children always come after their parents in preorder, so building the
+        # nodes back-to-front means children exist before their parents do.
+        for i in range(count - 1, -1, -1):
+            type_id = type_ids[i]
+            node_class = TypeIdClasses.get(type_id, None)
+            if node_class is None:
+                raise ValueError(f"unknown type id {type_id} at index {i}")
+            left = nodes[lefts[i]] if lefts[i] != NO_NODE else None
+            right = nodes[rights[i]] if rights[i] != NO_NODE else None
+            node: MathExpression
+            if node_class is ConstantExpression:
+                node = ConstantExpression(self.constants[constant_indices[i]])
+            elif node_class is VariableExpression:
+                symbol = symbol_indices[i]
+                node = VariableExpression(
+                    self.symbols[symbol] if symbol != NO_NODE else None
+                )
+            elif issubclass(node_class, UnaryExpression):
+                if right is not None:
+                    node = node_class(right, child_on_left=False)  # type:ignore
+                else:
+                    node = node_class(left)  # type:ignore
+            elif issubclass(node_class, BinaryExpression):
+                node = node_class(left, right)
+            else:  # pragma: nocover
+                raise ValueError(f"unsupported node class: {node_class}")
+            nodes[i] = node
+        root = nodes[0]
+        assert root is not None
+        return root
+
+    def get_order(self, visit: str = "preorder") -> np.ndarray:
+        """Return the node indices of this tree in the given visit order.
+
+        The flat tree is stored in preorder, so the "preorder" result is the
+        identity. Use "inorder" to map the token indices that actions refer to
+        onto positions in the flat arrays.
+
+        # Arguments
+        visit (str): One of "preorder", "inorder", or "postorder"
+
+        # Returns
+        (np.ndarray): An int32 array of node indices in the given order
+        """
+        count = len(self.type_id)
+        if visit == "preorder":
+            return np.arange(count, dtype="int32")
+        if visit not in ["inorder", "postorder"]:
+            raise ValueError(f"invalid visit order: {visit}")
+        lefts = self.left.tolist()
+        rights = self.right.tolist()
+        result: List[int] = []
+        if count == 0:
+            return np.array(result, dtype="int32")
+        if visit == "inorder":
+            stack: List[int] = []
+            current = 0
+            while stack or current != NO_NODE:
+                while current != NO_NODE:
+                    stack.append(current)
+                    current = lefts[current]
+                current = stack.pop()
+                result.append(current)
+                current = rights[current]
+        else:
+            # Postorder is the reverse of a (visit, right, left) preorder walk
+            stack = [0]
+            while stack:
+                current = stack.pop()
+                result.append(current)
+                if lefts[current] != NO_NODE:
+                    stack.append(lefts[current])
+                if rights[current] != NO_NODE:
+                    stack.append(rights[current])
+            result.reverse()
+        return np.array(result, dtype="int32")
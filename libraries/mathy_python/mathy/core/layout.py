@@ -9,9 +9,18 @@ algorithm that works with expression trees. It produces beautiful trees like:
 `mathy:(2x^3 + y)(14 + 2.3y)`
 
 """
+from typing import Optional
+
 from .tree import BinaryTreeNode
 
 
+def get_level(node: Optional[BinaryTreeNode]) -> int:
+    """Get the extreme level marker for a node, or -1 if it has none"""
+    if node is None:
+        return -1
+    return node.get_extra("level", -1)
+
+
 class TreeLayout:
     """Calculate a visual layout for input trees."""
 
@@ -50,10 +59,10 @@ class TreeLayout:
         # Avoid selecting as extreme
         if not node:
             if extremes.left is not None:
-                extremes.left.level = -1
+                extremes.left.set_extra("level", -1)
 
             if extremes.right is not None:
-                extremes.right.level = -1
+                extremes.right.set_extra("level", -1)
 
             return self
 
@@ -97,20 +106,20 @@ class TreeLayout:
             if left.right and left.offset:
                 left_offset_sum += left.offset
                 current_separation -= left.offset
-                left = getattr(left, "thread", left.right)
+                left = left.get_extra("thread", left.right)
             elif left.offset is not None:
                 left_offset_sum -= left.offset
                 current_separation += left.offset
-                left = getattr(left, "thread", left.left)
+                left = left.get_extra("thread", left.left)
 
             if right.left and right.offset:
                 right_offset_sum -= right.offset
                 current_separation -= right.offset
-                right = getattr(right, "thread", right.left)
+                right = right.get_extra("thread", right.left)
             elif right.offset is not None:
                 right_offset_sum += right.offset
                 current_separation += right.offset
-                right = getattr(right, "thread", right.right)
+                right = right.get_extra("thread", right.right)
 
         # Set the root offset, and include it in the accumulated offsets.
         node.offset = (root_separation + 1) / 2
@@ -118,8 +127,8 @@ class TreeLayout:
         right_offset_sum += node.offset
 
         # Update right and left extremes
-        right_left_level = getattr(right_extremes.left, "level", -1)
-        left_left_level = getattr(left_extremes.left, "level", -1)
+        right_left_level = get_level(right_extremes.left)
+        left_left_level = get_level(left_extremes.left)
         if right_left_level > left_left_level or not node.left:
             extremes.left = right_extremes.left
             if extremes.left:
@@ -130,8 +139,8 @@ class TreeLayout:
             if extremes.left:
                 extremes.left.offset -= node.offset
 
-        left_right_level = getattr(left_extremes.right, "level", -1)
-        right_right_level = getattr(right_extremes.right, "level", -1)
+        left_right_level = get_level(left_extremes.right)
+        right_right_level = get_level(right_extremes.right)
         if left_right_level > right_right_level or not node.right:
             extremes.right = left_extremes.right
             if extremes.right:
@@ -145,12 +154,12 @@ class TreeLayout:
         # If the subtrees have uneven heights, check to see if they need to be
         # threaded.  If threading is required, it will affect only one node.
         if left and left != node.left and right_extremes and right_extremes.right:
-            right_extremes.right.thread = left
+            right_extremes.right.set_extra("thread", left)
             right_extremes.right.offset = abs(
                 right_extremes.right.offset + node.offset - left_offset_sum
             )
         elif right and right != node.right and left_extremes and left_extremes.left:
-            left_extremes.left.thread = right
+            left_extremes.left.set_extra("thread", right)
             left_extremes.left.offset = abs(
                 left_extremes.left.offset - node.offset - right_offset_sum
             )
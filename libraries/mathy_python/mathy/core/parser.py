@@ -1,5 +1,8 @@
-from typing import Dict, List, Optional, Union
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, NamedTuple, Optional, Sequence, Set, Tuple, Union
 
+from .cache import LRUCache
 from .expressions import (
     AddExpression,
     ConstantExpression,
@@ -12,6 +15,7 @@ from .expressions import (
     SubtractExpression,
     VariableExpression,
 )
+from .flat import FlatTree
 from .tokenizer import (
     Token,
     TokenCloseParen,
@@ -98,7 +102,37 @@ _IS_EXP: TokenSet = TokenSet(TokenExponent)
 _IS_EQUAL: TokenSet = TokenSet(TokenEqual)
 
 
-# NOTE: This cannot be shared between threads because it stores state in self.current_token and self.tokens
+class ParseContext:
+    """The state of a single call to #ExpressionParser.parse: the tokens being
+    parsed, the position of the next token, and the token being looked at.
+
+    Keeping this state out of the parser means that one parser (and its caches)
+    can be used by many threads at the same time."""
+
+    tokens: List[Token]
+    index: int
+    current_token: Token
+
+    def __init__(self, tokens: List[Token]):
+        self.tokens = tokens
+        self.index = 0
+        self.current_token = Token("", TokenNone)
+
+
+class ParseResult(NamedTuple):
+    """The result of parsing one input with #ExpressionParser.parse_many"""
+
+    text: str
+    # The parsed tree (or its #FlatTree encoding), or None if parsing failed
+    expression: Optional[Union[MathExpression, FlatTree]]
+    # The error message if parsing failed, or None
+    error: Optional[str]
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
 class ExpressionParser:
     """Parser for converting text into binary trees. Trees encode the order of
     operations for an input, and allow evaluating it to detemrine the expression
@@ -135,71 +169,194 @@ class ExpressionParser:
     (EqualExp)     = (AddExp) { { "=" }? (AddExp) }*
     (start)        = (EqualExp)
     ```
+
+    ### Threads
+
+    The state of each parse is kept in a #ParseContext, and the caches hold a
+    lock for every operation, so a single parser can be shared between threads.
+    Cached expressions are frozen, so threads can't change a cached tree under
+    each other. Callers that change a parsed tree clone it first.
     """
 
-    _parse_cache: Dict[str, MathExpression]
-    _tokens_cache: Dict[str, List[Token]]
+    parse_cache: LRUCache[str, MathExpression]
+    tokens_cache: LRUCache[str, List[Token]]
 
     # Initialize the tokenizer.
-    def __init__(self):
+    def __init__(self, parse_cache_size: int = 1024, tokens_cache_size: int = 1024):
+        """Create a parser with bounded LRU caches for parsed expressions and
+        tokens. The caches keep their contents until they are full, so common
+        problems aren't parsed again. Pass a size of 0 to disable a cache.
+
+        The hit, miss, and eviction counts of the caches are available from
+        `parser.parse_cache.stats` and `parser.tokens_cache.stats`."""
         self.tokenizer = Tokenizer()
-        self.clear_cache()
+        self.parse_cache = LRUCache(parse_cache_size)
+        self.tokens_cache = LRUCache(tokens_cache_size)
 
     def clear_cache(self):
-        self._tokens_cache = {}
-        self._parse_cache = {}
+        """Remove all the cached expressions and tokens"""
+        self.tokens_cache.clear()
+        self.parse_cache.clear()
 
     def tokenize(self, input_text: str):
-        if input_text not in self._tokens_cache:
-            self._tokens_cache[input_text] = self.tokenizer.tokenize(input_text)
-        return self._tokens_cache[input_text][:]
+        return self._get_tokens(input_text)[:]
+
+    def _get_tokens(self, input_text: str) -> List[Token]:
+        """Return the (shared) cached tokens for the given text. The parser
+        only reads from token lists, so it doesn't need a copy."""
+        tokens = self.tokens_cache.get(input_text)
+        if tokens is None:
+            tokens = self.tokenizer.tokenize(input_text)
+            self.tokens_cache.put(input_text, tokens)
+        return tokens
 
     def parse(self, input_text: str) -> MathExpression:
         """Parse a string representation of an expression into a tree
         that can be later evaluated.
 
-        Returns : The evaluatable expression tree.
+        Parsed trees are cached and frozen, and each call with the same text
+        returns the same tree. Callers that change the tree (e.g. by applying
+        rules to it) must change a `clone()` of it instead. When the parse cache
+        is disabled nothing is shared, and the new tree isn't frozen.
+
+        # Arguments
+        input_text (str): The text to parse
+
+        # Returns
+        (MathExpression): The evaluatable expression tree
+        """
+        expression = self.parse_cache.get(input_text)
+        if expression is None:
+            expression = self._parse(self._get_tokens(input_text))
+            if self.parse_cache.capacity > 0:
+                self.parse_cache.put(input_text, expression.freeze())
+        return expression
+
+    def parse_many(
+        self,
+        texts: Sequence[str],
+        workers: Optional[int] = 1,
+        flat: bool = False,
+        min_pool_size: int = 1000,
+        cache: bool = False,
+    ) -> List[ParseResult]:
+        """Parse many inputs, returning one #ParseResult per input in the same
+        order. Inputs that fail to parse have an `error` message rather than
+        raising an exception, so one bad input doesn't stop a batch.
+
+        Duplicate inputs are only parsed once, and share the same frozen tree.
+        Other results are new trees that the caller owns, and they don't go
+        through the parser's caches, so a large batch doesn't evict the trees
+        that are in use. Pass `cache=True` to read and fill the parse cache like
+        #ExpressionParser.parse does, in which case the trees are frozen.
+
+        When there are at least `min_pool_size` inputs to parse, and more than
+        one worker and CPU, they are parsed in a pool of processes. Trees are
+        sent back from the workers in the #MathExpression.to_bytes encoding,
+        which is exact, and smaller and faster to transfer than trees of Python
+        objects.
+
+        # Arguments
+        texts (Sequence[str]): The inputs to parse
+        workers (Optional[int]): The number of processes to parse with, or None
+            to use one per CPU
+        flat (bool): Return #FlatTree encodings instead of expression trees
+        min_pool_size (int): The fewest inputs to parse to use a process pool for
+        cache (bool): Read and fill the parse cache with the results
+
+        # Returns
+        (List[ParseResult]): The parse result for each input, in input order
         """
-        if input_text in self._parse_cache:
-            return self._parse_cache[input_text]
-        self._parse_cache[input_text] = self._parse(self.tokenize(input_text))
-        return self._parse_cache[input_text]
+        # More processes than CPUs only add the cost of sending the results back
+        workers = min(workers or os.cpu_count() or 1, os.cpu_count() or 1)
+        results: Dict[str, ParseResult] = {}
+        duplicates: Set[str] = set()
+        pending: List[str] = []
+        for text in texts:
+            if text in results:
+                duplicates.add(text)
+                continue
+            expression = self.parse_cache.get(text) if cache else None
+            if expression is None:
+                # Mark the text as seen, the real result is filled in below
+                results[text] = ParseResult(text, None, None)
+                pending.append(text)
+            else:
+                encoded = FlatTree.from_expression(expression) if flat else expression
+                results[text] = ParseResult(text, encoded, None)
+
+        def add_result(text: str, expression: MathExpression) -> None:
+            if cache:
+                self.parse_cache.put(text, expression.freeze())
+            elif text in duplicates and not flat:
+                expression.freeze()
+            encoded = FlatTree.from_expression(expression) if flat else expression
+            results[text] = ParseResult(text, encoded, None)
+
+        if workers > 1 and len(pending) >= min_pool_size:
+            chunk_size = -(-len(pending) // (workers * 4))
+            chunks = [
+                pending[i : i + chunk_size]
+                for i in range(0, len(pending), chunk_size)
+            ]
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                for chunk, parsed in zip(chunks, pool.map(_parse_encoded, chunks)):
+                    for text, (data, error) in zip(chunk, parsed):
+                        if data is None:
+                            results[text] = ParseResult(text, None, error)
+                        else:
+                            add_result(text, MathExpression.from_bytes(data))
+        else:
+            for text in pending:
+                # The text was already looked up in the cache above, so parse it
+                # directly to count it as one miss
+                try:
+                    tokens = (
+                        self._get_tokens(text)
+                        if cache
+                        else self.tokenizer.tokenize(text)
+                    )
+                    expression = self._parse(tokens)
+                except Exception as error:
+                    results[text] = ParseResult(text, None, str(error))
+                    continue
+                add_result(text, expression)
+        return [results[text] for text in texts]
 
     def _parse(self, tokens: List[Token]) -> MathExpression:
         """Parse a given list of tokens into an expression tree"""
-        self.tokens = tokens
-        self.current_token = Token("", TokenNone)
-        if not self.next():
+        context = ParseContext(tokens)
+        if not self.next(context):
             raise InvalidExpression("Cannot parse an empty function")
 
-        expression: MathExpression = self.parse_equal()
+        expression: MathExpression = self.parse_equal(context)
         leftover = ""
-        while self.current_token.type != TokenEOF:
-            leftover = f"{leftover}{self.current_token.value}"
-            self.next()
+        while context.current_token.type != TokenEOF:
+            leftover = f"{leftover}{context.current_token.value}"
+            self.next(context)
 
         if leftover != "":
             raise TrailingTokens("Trailing characters: {}".format(leftover))
         return expression
 
-    def parse_equal(self) -> MathExpression:
-        if not self.check(_FIRST_ADD):
+    def parse_equal(self, context: ParseContext) -> MathExpression:
+        if not self.check(context, _FIRST_ADD):
             raise InvalidSyntax("Invalid expression")
 
-        exp = self.parse_add()
-        while self.check(_IS_EQUAL):
-            opType = self.current_token.type
-            opValue = self.current_token.value
-            self.eat(opType)
-            expected = self.check(_FIRST_ADD)
+        exp = self.parse_add(context)
+        while self.check(context, _IS_EQUAL):
+            opType = context.current_token.type
+            opValue = context.current_token.value
+            self.eat(context, opType)
+            expected = self.check(context, _FIRST_ADD)
             right = None
             if expected:
-                right = self.parse_add()
+                right = self.parse_add(context)
 
             if not expected or not right:
                 raise UnexpectedBehavior(
                     "Expected an expression after = operator, got: {}".format(
-                        self.current_token.value
+                        context.current_token.value
                     )
                 )
 
@@ -212,24 +369,24 @@ class ExpressionParser:
 
         return exp
 
-    def parse_add(self) -> MathExpression:
-        if not self.check(_FIRST_MULT):
+    def parse_add(self, context: ParseContext) -> MathExpression:
+        if not self.check(context, _FIRST_MULT):
             raise InvalidSyntax("Invalid expression")
 
-        exp = self.parse_mult()
-        while self.check(_IS_ADD):
-            opType = self.current_token.type
-            opValue = self.current_token.value
-            self.eat(opType)
-            expected = self.check(_FIRST_MULT)
+        exp = self.parse_mult(context)
+        while self.check(context, _IS_ADD):
+            opType = context.current_token.type
+            opValue = context.current_token.value
+            self.eat(context, opType)
+            expected = self.check(context, _FIRST_MULT)
             right = None
             if expected:
-                right = self.parse_mult()
+                right = self.parse_mult(context)
 
             if not expected or not right:
                 raise UnexpectedBehavior(
                     "Expected an expression after + or - operator, got: {}".format(
-                        self.current_token.value
+                        context.current_token.value
                     )
                 )
 
@@ -244,19 +401,19 @@ class ExpressionParser:
 
         return exp
 
-    def parse_mult(self) -> MathExpression:
-        if not self.check(_FIRST_EXP):
+    def parse_mult(self, context: ParseContext) -> MathExpression:
+        if not self.check(context, _FIRST_EXP):
             raise InvalidSyntax("Invalid expression")
 
-        exp = self.parse_exponent()
-        while self.check(_IS_MULT):
-            opType = self.current_token.type
-            opValue = self.current_token.value
-            self.eat(opType)
-            expected = self.check(_FIRST_EXP)
+        exp = self.parse_exponent(context)
+        while self.check(context, _IS_MULT):
+            opType = context.current_token.type
+            opValue = context.current_token.value
+            self.eat(context, opType)
+            expected = self.check(context, _FIRST_EXP)
             right = None
             if expected:
-                right = self.parse_mult()
+                right = self.parse_mult(context)
 
             if not expected or right is None:
                 raise InvalidSyntax(
@@ -275,56 +432,56 @@ class ExpressionParser:
                 )
         return exp
 
-    def parse_exponent(self) -> MathExpression:
-        if not self.check(_FIRST_UNARY):
+    def parse_exponent(self, context: ParseContext) -> MathExpression:
+        if not self.check(context, _FIRST_UNARY):
             raise InvalidSyntax("Invalid expression")
 
-        exp = self.parse_unary()
-        if self.check(TokenSet(TokenExponent)):
-            opType = self.current_token.type
-            self.eat(opType)
-            if not self.check(_FIRST_UNARY):
+        exp = self.parse_unary(context)
+        if self.check(context, TokenSet(TokenExponent)):
+            opType = context.current_token.type
+            self.eat(context, opType)
+            if not self.check(context, _FIRST_UNARY):
                 raise InvalidSyntax("Expected an expression after ^ operator")
 
-            right = self.parse_unary()
+            right = self.parse_unary(context)
             if opType == TokenExponent:
                 exp = PowerExpression(exp, right)
             else:
                 raise UnexpectedBehavior("Expected exponent, got: {}".format(opType))
         return exp
 
-    def parse_unary(self) -> MathExpression:
+    def parse_unary(self, context: ParseContext) -> MathExpression:
         value: Union[float, int] = 0
         negate = False
-        if self.current_token.type == TokenMinus:
-            self.eat(TokenMinus)
+        if context.current_token.type == TokenMinus:
+            self.eat(context, TokenMinus)
             negate = True
-        expected = self.check(_FIRST_FACTOR_PREFIX)
+        expected = self.check(context, _FIRST_FACTOR_PREFIX)
         exp: Optional[MathExpression] = None
         if expected:
-            if self.current_token.type == TokenConstant:
-                if isinstance(self.current_token.value, str):
-                    value = coerce_to_number(self.current_token.value)
+            if context.current_token.type == TokenConstant:
+                if isinstance(context.current_token.value, str):
+                    value = coerce_to_number(context.current_token.value)
                 else:
-                    value = self.current_token.value
+                    value = context.current_token.value
                 # Flip parse as float/int based on whether the value text
                 if negate:
                     value = -value
                     negate = False
 
                 exp = ConstantExpression(value)
-                self.eat(TokenConstant)
+                self.eat(context, TokenConstant)
 
-            if self.check(_FIRST_FACTOR):
+            if self.check(context, _FIRST_FACTOR):
                 if exp is None:
-                    exp = self.parse_factors()
+                    exp = self.parse_factors(context)
                 else:
-                    exp = MultiplyExpression(exp, self.parse_factors())
+                    exp = MultiplyExpression(exp, self.parse_factors(context))
 
         if not expected or exp is None:
             raise InvalidSyntax(
                 "Expected a function, variable or parenthesis after - or + but got : {}".format(
-                    self.current_token.value
+                    context.current_token.value
                 )
             )
         if negate:
@@ -332,40 +489,40 @@ class ExpressionParser:
 
         return exp
 
-    def parse_factors(self) -> MathExpression:
+    def parse_factors(self, context: ParseContext) -> MathExpression:
         right = None
         found = True
         factors: List[MathExpression] = []
         while found:
             right = None
-            opType = self.current_token.type
+            opType = context.current_token.type
             if opType == TokenVariable:
-                factors.append(VariableExpression(str(self.current_token.value)))
-                self.eat(TokenVariable)
+                factors.append(VariableExpression(str(context.current_token.value)))
+                self.eat(context, TokenVariable)
             elif opType == TokenFunction:
-                factors.append(self.parse_function())
+                factors.append(self.parse_function(context))
             elif opType == TokenOpenParen:
-                self.eat(TokenOpenParen)
-                factors.append(self.parse_add())
-                self.eat(TokenCloseParen)
+                self.eat(context, TokenOpenParen)
+                factors.append(self.parse_add(context))
+                self.eat(context, TokenCloseParen)
             else:
                 raise UnexpectedBehavior(
-                    "Unexpected token in Factor: {}".format(self.current_token.type)
+                    "Unexpected token in Factor: {}".format(context.current_token.type)
                 )
 
-            found = self.check(_FIRST_FACTOR)
+            found = self.check(context, _FIRST_FACTOR)
 
         if len(factors) == 0:
             raise InvalidExpression("No factors")
 
         exp: Optional[MathExpression] = None
-        if self.check(_IS_EXP):
-            opType = self.current_token.type
-            self.eat(opType)
-            if not self.check(_FIRST_UNARY):
+        if self.check(context, _IS_EXP):
+            opType = context.current_token.type
+            self.eat(context, opType)
+            if not self.check(context, _FIRST_UNARY):
                 raise InvalidSyntax("Expected an expression after ^ operator")
 
-            right = self.parse_unary()
+            right = self.parse_unary(context)
             exp = PowerExpression(factors[-1], right)
 
         if len(factors) == 1:
@@ -380,31 +537,32 @@ class ExpressionParser:
         assert exp is not None
         return exp
 
-    def parse_function(self) -> MathExpression:
-        opFn = self.current_token.value
-        self.eat(self.current_token.type)
-        self.eat(TokenOpenParen)
-        exp = self.parse_add()
-        self.eat(TokenCloseParen)
+    def parse_function(self, context: ParseContext) -> MathExpression:
+        opFn = context.current_token.value
+        self.eat(context, context.current_token.type)
+        self.eat(context, TokenOpenParen)
+        exp = self.parse_add(context)
+        self.eat(context, TokenCloseParen)
         func = self.tokenizer.functions[opFn]
         if func is None:
             raise UnexpectedBehavior("Unknown Function type: {}".format(opFn))
 
         return func(exp)
 
-    def next(self) -> bool:
-        """Assign the next token in the queue to `self.current_token`.
+    def next(self, context: ParseContext) -> bool:
+        """Assign the next token in the queue to `context.current_token`.
 
         Return True if there are still more tokens in the queue, or False if there
         are no more tokens to look at."""
 
-        if self.current_token.type == TokenEOF:
+        if context.current_token.type == TokenEOF:
             raise OutOfTokens("Parsed beyond the end of the expression")
 
-        self.current_token = self.tokens.pop(0)
-        return self.current_token.type != TokenEOF
+        context.current_token = context.tokens[context.index]
+        context.index += 1
+        return context.current_token.type != TokenEOF
 
-    def eat(self, type) -> bool:
+    def eat(self, context: ParseContext, type) -> bool:
         """Assign the next token in the queue to current_token if its type
         matches that of the specified parameter. If the type does not match,
         raise a syntax exception.
@@ -412,17 +570,31 @@ class ExpressionParser:
         Args:
             - `type` The type that your syntax expects @current_token to be
         """
-        if self.current_token.type != type:
+        if context.current_token.type != type:
             raise InvalidSyntax("Missing: {}".format(type))
 
-        return self.next()
+        return self.next(context)
 
-    def check(self, tokens) -> bool:
-        """Check if the `self.current_token` is a member of a set Token types
+    def check(self, context: ParseContext, tokens) -> bool:
+        """Check if the `context.current_token` is a member of a set Token types
         
         Args:
             - `tokens` The set of Token types to check against
         
         `Returns` True if the `current_token`'s type is in the set else False"""
 
-        return tokens.contains(self.current_token.type)
+        return tokens.contains(context.current_token.type)
+
+
+def _parse_encoded(texts: List[str]) -> List[Tuple[Optional[bytes], Optional[str]]]:
+    """Parse a chunk of inputs in a worker process for
+    #ExpressionParser.parse_many, and encode the trees with
+    #MathExpression.to_bytes. The inputs are unique so no caches are used."""
+    parser = ExpressionParser(parse_cache_size=0, tokens_cache_size=0)
+    results: List[Tuple[Optional[bytes], Optional[str]]] = []
+    for text in texts:
+        try:
+            results.append((parser.parse(text).to_bytes(), None))
+        except Exception as error:
+            results.append((None, str(error)))
+    return results
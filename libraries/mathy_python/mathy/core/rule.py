@@ -1,11 +1,37 @@
-from typing import Optional, List
+import sys
+import threading
+from typing import (
+    Callable,
+    Dict,
+    List,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Tuple,
+    Type,
+    Union,
+)
+from ..core.cache import LRUCache
 from ..core.expressions import MathExpression
-from ..core.tree import STOP
 from ..util import is_debug_mode
 
 
 class BaseRule:
-    """Basic rule class that visits a tree with a specified visit order."""
+    """Basic rule class that visits a tree with a specified visit order.
+
+    Rules declare the classes of nodes that they can be applied to in
+    `node_types`, so that #RuleDispatch can skip calling `can_apply_to` for
+    nodes of any other type. The default matches every node.
+
+    `can_apply_to` may only look at a node's subtree and the types of its parent
+    and sibling. Rules that look no deeper than a fixed number of levels below
+    the node declare it in `match_depth` (e.g. 1 for the node's children), so
+    #RuleDispatch.rematch doesn't check them again for ancestors that are
+    further above a change. The default of None means no limit.
+    """
+
+    node_types: Tuple[Type[MathExpression], ...] = (MathExpression,)
+    match_depth: Optional[int] = None
 
     @property
     def name(self):
@@ -19,18 +45,10 @@ class BaseRule:
 
     def find_node(self, expression: MathExpression) -> Optional[MathExpression]:
         """Find the first node that can have this rule applied to it."""
-        result = None
-
-        def visit_fn(node, depth, data):
-            nonlocal result
+        for node in expression.iter_inorder():
             if self.can_apply_to(node):
-                result = node
-
-            if result is not None:
-                return STOP
-
-        expression.visit_inorder(visit_fn)
-        return result
+                return node
+        return None
 
     def find_nodes(self, expression: MathExpression) -> List[MathExpression]:
         """Find all nodes in an expression that can have this rule applied to them.
@@ -38,20 +56,10 @@ class BaseRule:
         the visit strategy, and stored as `node.r_index` starting with index 0
         """
         nodes = []
-        index = 0
-
-        def visit_fn(node, depth, data):
-            nonlocal nodes, index
-            add = None
+        for index, node in enumerate(expression.iter_inorder()):
             node.r_index = index
             if self.can_apply_to(node):
-                add = node
-
-            index += 1
-            if add:
-                return nodes.append(add)
-
-        expression.visit_inorder(visit_fn)
+                nodes.append(node)
         return nodes
 
     def can_apply_to(self, node: MathExpression) -> bool:
@@ -78,6 +86,284 @@ class BaseRule:
         return ExpressionChangeRule(self, node)
 
 
+class RuleMatches(NamedTuple):
+    """The nodes of an expression that a list of rules can be applied to, as
+    found by #match_rules"""
+
+    # Action mask of length (nodes * rules), where the value at index
+    # (node_index * len(rules)) + rule_index is 1 if the rule can be applied to
+    # the node with that inorder token index, and 0 otherwise.
+    actions: List[int]
+    # Vector of length (rules) that is 1 if a rule can be applied to any node
+    rules: List[int]
+
+
+class CachedRuleMatches(NamedTuple):
+    """An entry of a rule matches cache, which is keyed by the fingerprint of
+    an expression. It holds the (frozen) expression that the matches are for,
+    so a lookup can confirm that it found the same expression, and not one
+    with a colliding fingerprint."""
+
+    expression: MathExpression
+    matches: RuleMatches
+
+
+# (rule_index, can_apply_to) pairs for the rules that may match a node type
+RuleChecks = List[Tuple[int, Callable[[MathExpression], bool]]]
+
+
+class RuleDispatch:
+    """A table of the rules that can target each class of node, built from the
+    `node_types` that the rules declare.
+
+    Looking up the candidate rules for a node is a single dict lookup by its
+    class, so the rules that can't apply to it are never called. Entries are
+    added the first time a node class is seen.
+
+    # Arguments
+    rules (Sequence[BaseRule]): The rules to dispatch, in action order
+    """
+
+    rules: List[BaseRule]
+
+    def __init__(self, rules: Sequence[BaseRule]):
+        self.rules = list(rules)
+        self._checks: Dict[Type[MathExpression], RuleChecks] = {}
+        self._depths = [
+            rule.match_depth if rule.match_depth is not None else sys.maxsize
+            for rule in self.rules
+        ]
+
+    def get_checks(self, node_type: Type[MathExpression]) -> RuleChecks:
+        """Get the (rule_index, can_apply_to) pairs of the rules that declare
+        `node_type` or one of its base classes in their `node_types`"""
+        checks = self._checks.get(node_type, None)
+        if checks is None:
+            checks = [
+                (rule_index, rule.can_apply_to)
+                for rule_index, rule in enumerate(self.rules)
+                if issubclass(node_type, rule.node_types)
+            ]
+            self._checks[node_type] = checks
+        return checks
+
+    def match(self, expression: MathExpression) -> RuleMatches:
+        """Find all the nodes that each rule can be applied to with one inorder
+        walk over the expression. See #match_rules."""
+        rule_count = len(self.rules)
+        checks = self._checks
+        actions = [0] * (rule_count * expression.size)
+        valid = [0] * rule_count
+        offset = 0
+        for node in expression.iter_inorder():
+            node_checks = checks.get(type(node), None)
+            if node_checks is None:
+                node_checks = self.get_checks(type(node))
+            for rule_index, can_apply_to in node_checks:
+                if can_apply_to(node):
+                    actions[offset + rule_index] = 1
+                    valid[rule_index] = 1
+            offset += rule_count
+        return RuleMatches(actions, valid)
+
+    def rematch(
+        self,
+        changed: MathExpression,
+        replaced: MathExpression,
+        previous_actions: List[int],
+    ) -> RuleMatches:
+        """Update the action mask of an expression after the subtree at one
+        position was replaced, without checking every node against every rule.
+
+        Rules only look at a node's subtree, and at the types of its parent and
+        sibling. So when the subtree at the position of `changed` is replaced,
+        the nodes outside of it keep their matches, other than its sibling, and
+        the ancestors within the `match_depth` of each rule, which are checked
+        again. Inside the new subtree, any part that is also found in the
+        replaced one (an identical subtree, with the same types of parent and
+        sibling) copies its matches from there. Parts are looked up by their
+        fingerprint, and compared with #MathExpression.is_identical before
+        their matches are copied. Only the remaining nodes are checked against
+        the rules.
+
+        # Arguments
+        changed (MathExpression): The root of the new subtree in `expression`
+        replaced (MathExpression): The root of the subtree at the same position
+            in the expression before the change
+        previous_actions (List[int]): The action mask of the expression before
+            the change, as returned by #RuleDispatch.match
+
+        # Returns
+        (RuleMatches): The action mask and valid rules vector for the expression
+        """
+        rule_count = len(self.rules)
+        checks = self._checks
+        depths = self._depths
+
+        def check(node: MathExpression, index: int, distance: int = 0) -> None:
+            # Update the matches of the rules that look `distance` levels deep
+            offset = index * rule_count
+            node_checks = checks.get(type(node), None)
+            if node_checks is None:
+                node_checks = self.get_checks(type(node))
+            for rule_index, can_apply_to in node_checks:
+                if distance <= depths[rule_index]:
+                    actions[offset + rule_index] = 1 if can_apply_to(node) else 0
+
+        # The (parent, child) links from the root down to the changed node
+        path: List[Tuple[MathExpression, MathExpression]] = []
+        node = changed
+        while node.parent is not None:
+            path.append((node.parent, node))
+            node = node.parent
+        path.reverse()
+        # The first token index of each parent's subtree, and the changed one's
+        bases: List[int] = []
+        start = 0
+        for parent, child in path:
+            bases.append(start)
+            if parent.right is child:
+                start += 1 + (parent.left.size if parent.left is not None else 0)
+        changed_size = changed.size
+        actions = (
+            previous_actions[: start * rule_count]
+            + [0] * (changed_size * rule_count)
+            + previous_actions[(start + replaced.size) * rule_count :]
+        )
+        # Ancestors and the sibling may depend on the changed subtree
+        for distance, ((parent, _), base) in enumerate(zip(path, bases)):
+            left_size = parent.left.size if parent.left is not None else 0
+            check(parent, base + left_size, len(path) - distance)
+        if path:
+            parent, _ = path[-1]
+            if parent.left is changed:
+                sibling, base = parent.right, start + changed_size + 1
+            else:
+                sibling, base = parent.left, bases[-1]
+            if sibling is not None:
+                left_size = sibling.left.size if sibling.left is not None else 0
+                check(sibling, base + left_size)
+
+        # Subtrees of the replaced expression, by fingerprint and context
+        reusable: Dict[Tuple[int, type, type], Tuple[MathExpression, int]] = {}
+        stack: List[Tuple[MathExpression, int]] = [(replaced, start)]
+        while stack:
+            node, base = stack.pop()
+            reusable[_get_context_key(node)] = (node, base)
+            left_size = node.left.size if node.left is not None else 0
+            if node.left is not None:
+                stack.append((node.left, base))
+            if node.right is not None:
+                stack.append((node.right, base + left_size + 1))
+        stack = [(changed, start)]
+        while stack:
+            node, base = stack.pop()
+            previous = reusable.get(_get_context_key(node), None)
+            # Fingerprints can collide, so only copy the matches of a subtree
+            # that is the same as this one
+            if previous is not None and node.is_identical(previous[0]):
+                size = node.size * rule_count
+                offset = previous[1] * rule_count
+                actions[base * rule_count : base * rule_count + size] = (
+                    previous_actions[offset : offset + size]
+                )
+                continue
+            left_size = node.left.size if node.left is not None else 0
+            check(node, base + left_size)
+            if node.left is not None:
+                stack.append((node.left, base))
+            if node.right is not None:
+                stack.append((node.right, base + left_size + 1))
+        valid = [
+            1 if 1 in actions[rule_index::rule_count] else 0
+            for rule_index in range(rule_count)
+        ]
+        return RuleMatches(actions, valid)
+
+
+def _get_context_key(node: MathExpression) -> Tuple[int, type, type]:
+    """The fingerprint of a node's subtree with the types of its parent and
+    sibling, which together decide which rules can be applied to its nodes"""
+    parent = node.parent
+    if parent is None:
+        return node.fingerprint, type(None), type(None)
+    sibling = parent.right if parent.left is node else parent.left
+    return node.fingerprint, type(parent), type(sibling)
+
+
+def match_rules(
+    expression: MathExpression, rules: Union[Sequence[BaseRule], RuleDispatch]
+) -> RuleMatches:
+    """Find all the nodes that each rule can be applied to with one inorder walk
+    over the expression, rather than one walk per rule with #BaseRule.find_nodes.
+
+    Only the rules whose `node_types` include a node's class are checked
+    against it. Pass a #RuleDispatch to reuse its table between calls.
+
+    Unlike `find_nodes` this does not set `r_index` on the nodes.
+
+    # Arguments
+    expression (MathExpression): The expression to find matching nodes in
+    rules (Union[Sequence[BaseRule], RuleDispatch]): The rules to check each
+        node against
+
+    # Returns
+    (RuleMatches): The action mask and valid rules vector for the expression
+    """
+    if not isinstance(rules, RuleDispatch):
+        rules = RuleDispatch(rules)
+    return rules.match(expression)
+
+
+def get_rules_signature(rules: Sequence[BaseRule]) -> Tuple[str, ...]:
+    """A key that is equal for lists of rules that match the same nodes: the
+    same rule classes in the same order, with the same options.
+
+    # Arguments
+    rules (Sequence[BaseRule]): The rules to get the signature of
+
+    # Returns
+    (Tuple[str, ...]): The class name and options of each rule
+    """
+    return tuple(
+        [
+            f"{type(rule).__module__}.{type(rule).__qualname__}"
+            f"{sorted(vars(rule).items())}"
+            for rule in rules
+        ]
+    )
+
+
+# The shared rule matches caches, by the signature of their rules
+_shared_matches_caches: Dict[Tuple[str, ...], LRUCache[int, CachedRuleMatches]] = {}
+_shared_matches_lock = threading.Lock()
+
+
+def get_shared_matches_cache(
+    rules: Sequence[BaseRule], capacity: int = 4096
+) -> LRUCache[int, CachedRuleMatches]:
+    """Get the rule matches cache that is shared by all the environments in this
+    process with the same rules (see #get_rules_signature). Matches are keyed
+    by #MathExpression.fingerprint, and stored with their expression (see
+    #CachedRuleMatches).
+
+    # Arguments
+    rules (Sequence[BaseRule]): The rules that the cached matches are for
+    capacity (int): The number of expressions to keep matches for. Only used
+        by the first call for a set of rules, which creates the cache.
+
+    # Returns
+    (LRUCache[int, CachedRuleMatches]): The shared cache for the rules
+    """
+    key = get_rules_signature(rules)
+    with _shared_matches_lock:
+        cache = _shared_matches_caches.get(key, None)
+        if cache is None:
+            cache = LRUCache(capacity)
+            _shared_matches_caches[key] = cache
+        return cache
+
+
 class ExpressionChangeRule:
     """Object describing the change to an expression tree from a rule transformation"""
 
@@ -54,7 +54,6 @@ class TokenContext:
     tokens: List[Token]
     index: int
     buffer: str
-    chunk: str
 
     def __init__(
         self,
@@ -62,12 +61,10 @@ class TokenContext:
         tokens: Optional[List[Token]] = None,
         index: int = 0,
         buffer: str = "",
-        chunk: str = "",
     ):
         self.tokens = tokens if tokens is not None else []
         self.index = index
         self.buffer = buffer
-        self.chunk = chunk
 
 
 class Tokenizer:
@@ -110,31 +107,34 @@ class Tokenizer:
     def eat_token(self, context: TokenContext, typeFn):
         """Eat all of the tokens of a given type from the front of the stream
         until a different type is hit, and return the text."""
-        res = ""
-        for ch in list(context.chunk):
-            if not typeFn(ch):
-                return res
-            res = res + str(ch)
-
-        return res
+        buffer = context.buffer
+        end = context.index
+        length = len(buffer)
+        while end < length and typeFn(buffer[end]):
+            end += 1
+        return buffer[context.index : end]
 
     def tokenize(self, buffer: str, terms=False) -> List[Token]:
         """Return an array of `Token`s from a given string input.
-        This throws an exception if an unknown token type is found in the input."""
-        context = TokenContext(buffer=buffer, chunk=str(buffer))
-        while context.chunk and (
+        This throws an exception if an unknown token type is found in the input.
+
+        The input is scanned once, with `context.index` marking the position of
+        the next character, so tokenizing takes time linear in its length."""
+        context = TokenContext(buffer=buffer)
+        length = len(buffer)
+        while context.index < length and (
             self.identify_constants(context)
             or self.identify_alphas(context)
             or self.identify_operators(context)
         ):
-            context.chunk = context.buffer[context.index :]
+            pass
 
         context.tokens.append(Token("", TokenEOF))
         return context.tokens
 
     def identify_operators(self, context: TokenContext) -> bool:
         """Identify and tokenize operators."""
-        ch = context.chunk[0]
+        ch = context.buffer[context.index]
         if ch == " " or ch == "\t" or ch == "\r" or ch == "\n":
             pass
         elif ch == "+":
@@ -162,7 +162,7 @@ class Tokenizer:
 
     def identify_alphas(self, context: TokenContext) -> int:
         """Identify and tokenize functions and variables."""
-        if not self.is_alpha(context.chunk[0]):
+        if not self.is_alpha(context.buffer[context.index]):
             return False
 
         variable = self.eat_token(context, self.is_alpha)
@@ -178,7 +178,7 @@ class Tokenizer:
 
     def identify_constants(self, context: TokenContext) -> int:
         """Identify and tokenize a constant number."""
-        if not self.is_number(context.chunk[0]):
+        if not self.is_number(context.buffer[context.index]):
             return 0
 
         val = self.eat_token(context, self.is_number)
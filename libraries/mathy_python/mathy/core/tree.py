@@ -1,7 +1,8 @@
 import time
 import curses
+import itertools
 import uuid
-from typing import Optional, Union
+from typing import Any, Dict, Iterator, List, Optional, Tuple, Union
 
 # ## Constants
 
@@ -12,6 +13,10 @@ LEFT = "left"
 # The constant representing the right child side of a node.
 RIGHT = "right"
 
+# Source of unique node id numbers. Calling next() on an itertools.count is
+# atomic, so ids are unique across threads without needing a lock.
+_node_ids = itertools.count(1)
+
 
 class BinaryTreeNode:
     """
@@ -21,16 +26,14 @@ class BinaryTreeNode:
     children, and a parent.
     """
 
-    _idCounter = 0
-
-    # Tree layout mutations. Thanks, 2009 Justin. :( :(
-    x: Optional[float]
-    y: Optional[float]
-    offset: Optional[float]
+    __slots__ = ("_id", "left", "right", "parent", "_extra", "_frozen")
 
+    _id: Optional[str]
     left: Optional["BinaryTreeNode"]
     right: Optional["BinaryTreeNode"]
     parent: Optional["BinaryTreeNode"]
+    _extra: Optional[Dict[str, Any]]
+    _frozen: bool
 
     #  Allow specifying children in the constructor
     def __init__(
@@ -40,20 +43,124 @@ class BinaryTreeNode:
         parent: "BinaryTreeNode" = None,
         id: Optional[str] = None,
     ):
-        if id is None:
-            BinaryTreeNode._idCounter = BinaryTreeNode._idCounter + 1
-            id = f"mn-{BinaryTreeNode._idCounter}"
-        self.id = id
+        self._id = id
+        self._extra = None
+        self._frozen = False
         self.left = None
         self.right = None
-        self.set_left(left)
-        self.set_right(right)
         self.parent = parent
+        # Most new nodes are leaves, and there's nothing to do to set no child
+        if left is not None:
+            self.set_left(left)
+        if right is not None:
+            self.set_right(right)
+
+    @property
+    def id(self) -> str:
+        """A unique identifier for this node, e.g. "mn-42". Most ids are never
+        read, so they are only allocated the first time they are accessed."""
+        if self._id is None:
+            self._id = f"mn-{next(_node_ids)}"
+        return self._id
+
+    @id.setter
+    def id(self, value: Optional[str]) -> None:
+        self._id = value
+
+    # **Side Table**
+    #
+    # Most nodes are only ever used for structure, so data that only some
+    # features need (tree layout, rendering) is kept in an optional per-node
+    # table that is not allocated until something is stored in it.
+
+    def get_extra(self, key: str, default: Any = None) -> Any:
+        """Get a value from this node's side table, or `default` if it is not set"""
+        if self._extra is None:
+            return default
+        return self._extra.get(key, default)
+
+    def set_extra(self, key: str, value: Any) -> None:
+        """Set a value in this node's side table, allocating it if needed"""
+        if self._extra is None:
+            self._extra = {}
+        self._extra[key] = value
+
+    def pop_extra(self, key: str, default: Any = None) -> Any:
+        """Remove a value from this node's side table and return it, or return
+        `default` if it is not set. The side table is freed when it is empty."""
+        if self._extra is None:
+            return default
+        value = self._extra.pop(key, default)
+        if not self._extra:
+            self._extra = None
+        return value
+
+    # Tree layout mutations. Thanks, 2009 Justin. :( :(
+    @property
+    def x(self) -> Optional[float]:
+        """The horizontal layout position assigned by `TreeLayout`"""
+        return self.get_extra("x")
+
+    @x.setter
+    def x(self, value: Optional[float]) -> None:
+        self.set_extra("x", value)
+
+    @property
+    def y(self) -> Optional[float]:
+        """The vertical layout position assigned by `TreeLayout`"""
+        return self.get_extra("y")
+
+    @y.setter
+    def y(self, value: Optional[float]) -> None:
+        self.set_extra("y", value)
+
+    @property
+    def offset(self) -> Optional[float]:
+        """The layout offset from the parent node assigned by `TreeLayout`"""
+        return self.get_extra("offset")
+
+    @offset.setter
+    def offset(self, value: Optional[float]) -> None:
+        self.set_extra("offset", value)
+
+    # **Frozen Trees**
+    #
+    # Trees that are shared between callers (like cached parser results) are
+    # frozen so that changing them by accident raises an error instead of
+    # silently changing the tree for everyone. Clone a frozen tree to get a copy
+    # that can be changed.
+
+    @property
+    def frozen(self) -> bool:
+        """True if this node's structure cannot be changed"""
+        return self._frozen
+
+    def freeze(self) -> "BinaryTreeNode":
+        """Freeze this node and all of its descendants, so that changing their
+        children raises a ValueError. Clones of frozen nodes are not frozen.
+
+        # Returns
+        (BinaryTreeNode): This node
+        """
+        for node in self.iter_preorder():
+            node._frozen = True
+        return self
+
+    def check_mutable(self) -> None:
+        """Raise a ValueError if this node is frozen"""
+        if self._frozen:
+            raise ValueError(
+                f"cannot change frozen node: {self}. Clone the tree to change it."
+            )
 
     def clone(self):
-        """Create a clone of this tree"""
+        """Create a clone of this tree.
+
+        Clones share the ids of the nodes they were created from. Nodes whose
+        ids have not been allocated yet are cloned without ids, and each copy
+        gets its own id when it is first accessed. Clones are never frozen."""
         result = self.__class__()
-        result.id = self.id
+        result._id = self._id
         if self.left:
             result.set_left(self.left.clone())
 
@@ -85,6 +192,10 @@ class BinaryTreeNode:
             return self
 
         grand_parent = parent.parent
+        node.check_mutable()
+        parent.check_mutable()
+        if grand_parent is not None:
+            grand_parent.check_mutable()
         if node == parent.left:
             parent.set_left(node.right)
             node.right = parent
@@ -95,6 +206,8 @@ class BinaryTreeNode:
             parent.parent = node
 
         node.parent = grand_parent
+        parent.invalidate()
+        node.invalidate()
         if not grand_parent:
             return self
 
@@ -104,6 +217,79 @@ class BinaryTreeNode:
             grand_parent.right = node
         return self
 
+    def iter_preorder(self) -> Iterator["BinaryTreeNode"]:
+        """Iterate over the tree preorder, which yields the current node, then its
+        left child, and then its right child.
+
+        *Visit -> Left -> Right*
+
+        The traversal uses an explicit stack rather than recursion, so it works
+        for trees of any depth.
+
+        !!! info
+
+            Traversals may be stopped early by breaking out of the loop.
+        """
+        stack: List["BinaryTreeNode"] = [self]
+        while stack:
+            node = stack.pop()
+            yield node
+            if node.right is not None:
+                stack.append(node.right)
+            if node.left is not None:
+                stack.append(node.left)
+
+    def iter_inorder(self) -> Iterator["BinaryTreeNode"]:
+        """Iterate over the tree inorder, which yields the left child, then the
+        current node, and then its right child.
+
+        *Left -> Visit -> Right*
+
+        The traversal uses an explicit stack rather than recursion, so it works
+        for trees of any depth.
+
+        !!! info
+
+            Traversals may be stopped early by breaking out of the loop.
+        """
+        stack: List["BinaryTreeNode"] = []
+        node: Optional["BinaryTreeNode"] = self
+        while stack or node is not None:
+            while node is not None:
+                stack.append(node)
+                node = node.left
+            node = stack.pop()
+            yield node
+            node = node.right
+
+    def iter_postorder(self) -> Iterator["BinaryTreeNode"]:
+        """Iterate over the tree postorder, which yields the left child, then the
+        right child, and finally the current node.
+
+        *Left -> Right -> Visit*
+
+        The traversal uses an explicit stack rather than recursion, so it works
+        for trees of any depth.
+
+        !!! info
+
+            Traversals may be stopped early by breaking out of the loop.
+        """
+        stack: List["BinaryTreeNode"] = []
+        node: Optional["BinaryTreeNode"] = self
+        last: Optional["BinaryTreeNode"] = None
+        while stack or node is not None:
+            if node is not None:
+                stack.append(node)
+                node = node.left
+                continue
+            peek = stack[-1]
+            if peek.right is not None and last is not peek.right:
+                node = peek.right
+            else:
+                yield peek
+                last = stack.pop()
+
     def visit_preorder(self, visit_fn, depth=0, data=None):
         """Visit the tree preorder, which visits the current node, then its left
         child, and then its right child.
@@ -118,14 +304,16 @@ class BinaryTreeNode:
 
             Traversals may be canceled by returning `STOP` from any visit function.
         """
-        if visit_fn and visit_fn(self, depth, data) == STOP:
-            return STOP
-
-        if self.left and self.left.visit_preorder(visit_fn, depth + 1, data) == STOP:
-            return STOP
-
-        if self.right and self.right.visit_preorder(visit_fn, depth + 1, data) == STOP:
-            return STOP
+        stack: List[Tuple["BinaryTreeNode", int]] = [(self, depth)]
+        while stack:
+            node, node_depth = stack.pop()
+            if visit_fn and visit_fn(node, node_depth, data) == STOP:
+                return STOP
+            if node.right is not None:
+                stack.append((node.right, node_depth + 1))
+            if node.left is not None:
+                stack.append((node.left, node_depth + 1))
+        return None
 
     def visit_inorder(self, visit_fn, depth=0, data=None):
         """Visit the tree inorder, which visits the left child, then the current node,
@@ -141,14 +329,19 @@ class BinaryTreeNode:
 
             Traversals may be canceled by returning `STOP` from any visit function.
         """
-        if self.left and self.left.visit_inorder(visit_fn, depth + 1, data) == STOP:
-            return STOP
-
-        if visit_fn and visit_fn(self, depth, data) == STOP:
-            return STOP
-
-        if self.right and self.right.visit_inorder(visit_fn, depth + 1, data) == STOP:
-            return STOP
+        stack: List[Tuple["BinaryTreeNode", int]] = []
+        node: Optional["BinaryTreeNode"] = self
+        while stack or node is not None:
+            while node is not None:
+                stack.append((node, depth))
+                node = node.left
+                depth += 1
+            node, depth = stack.pop()
+            if visit_fn and visit_fn(node, depth, data) == STOP:
+                return STOP
+            node = node.right
+            depth += 1
+        return None
 
     def visit_postorder(self, visit_fn, depth=0, data=None):
         """Visit the tree postorder, which visits its left child, then its right child,
@@ -164,14 +357,24 @@ class BinaryTreeNode:
 
             Traversals may be canceled by returning `STOP` from any visit function.
         """
-        if self.left and self.left.visit_postorder(visit_fn, depth + 1, data) == STOP:
-            return STOP
-
-        if self.right and self.right.visit_postorder(visit_fn, depth + 1, data) == STOP:
-            return STOP
-
-        if visit_fn and visit_fn(self, depth, data) == STOP:
-            return STOP
+        stack: List[Tuple["BinaryTreeNode", int]] = []
+        node: Optional["BinaryTreeNode"] = self
+        last: Optional["BinaryTreeNode"] = None
+        while stack or node is not None:
+            if node is not None:
+                stack.append((node, depth))
+                node = node.left
+                depth += 1
+                continue
+            peek, peek_depth = stack[-1]
+            if peek.right is not None and last is not peek.right:
+                node = peek.right
+                depth = peek_depth + 1
+            else:
+                if visit_fn and visit_fn(peek, peek_depth, data) == STOP:
+                    return STOP
+                last, _ = stack.pop()
+        return None
 
     def get_root(self):
         """Return the root element of this tree"""
@@ -192,12 +395,19 @@ class BinaryTreeNode:
         """Set the left node to the passed `child`"""
         if child == self:
             raise ValueError("nodes cannot be their own children")
-        if self.left is not None and clear_old_child_parent:
-            self.left.parent = None
+        self.check_mutable()
+        if child is not None:
+            # Attaching a child changes its parent
+            child.check_mutable()
+        old_child = self.left
+        if old_child is not None and clear_old_child_parent:
+            old_child.check_mutable()
+        if old_child is not None and clear_old_child_parent:
+            old_child.parent = None
         self.left = child
         if self.left:
             self.left.parent = self
-
+        self._invalidate_children(old_child, child)
         return self
 
     def set_right(
@@ -206,14 +416,42 @@ class BinaryTreeNode:
         """Set the right node to the passed `child`"""
         if child == self:
             raise ValueError("nodes cannot be their own children")
-        if self.right is not None and clear_old_child_parent:
-            self.right.parent = None
+        self.check_mutable()
+        if child is not None:
+            # Attaching a child changes its parent
+            child.check_mutable()
+        old_child = self.right
+        if old_child is not None and clear_old_child_parent:
+            old_child.check_mutable()
+        if old_child is not None and clear_old_child_parent:
+            old_child.parent = None
         self.right = child
         if self.right:
             self.right.parent = self
-
+        self._invalidate_children(old_child, child)
         return self
 
+    def invalidate(self) -> None:
+        """Called when the structure of the tree changes at this node. Subclasses
+        that cache values derived from their subtrees override this to clear the
+        cached values of this node and its ancestors."""
+        pass
+
+    def _invalidate_children(
+        self,
+        old_child: Optional["BinaryTreeNode"],
+        new_child: Optional["BinaryTreeNode"],
+    ) -> None:
+        if old_child is None and new_child is None:
+            return
+        # A child's cached values may depend on where it is attached, so the
+        # children that moved are invalidated along with this node.
+        if old_child is not None and old_child is not new_child:
+            old_child.invalidate()
+        if new_child is not None:
+            new_child.invalidate()
+        self.invalidate()
+
     def get_side(self, child):
         """Determine whether the given `child` is the left or right child of this
         node"""
@@ -265,6 +503,8 @@ class BinaryTreeNode:
 class BinarySearchTree(BinaryTreeNode):
     """A binary search tree by key"""
 
+    __slots__ = ("key",)
+
     def __init__(self, key: Union[str, int, float] = None, **kwargs):
         super(BinarySearchTree, self).__init__(**kwargs)
         self.key = key
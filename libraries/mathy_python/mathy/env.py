@@ -1,12 +1,20 @@
-from itertools import groupby
-from typing import Any, Dict, List, Optional, Tuple, Type, Union
+from typing import Any, List, Optional, Tuple, Type, Union, cast
 
 import numpy as np
 
 from . import time_step
-from .core.expressions import STOP, MathExpression
+from .core.expressions import MathExpression
 from .core.parser import ExpressionParser
-from .core.rule import BaseRule, ExpressionChangeRule
+from .core.cache import LRUCache
+from .core.rule import (
+    BaseRule,
+    CachedRuleMatches,
+    ExpressionChangeRule,
+    RuleDispatch,
+    RuleMatches,
+    get_shared_matches_cache,
+    match_rules,
+)
 from .rules import (
     AssociativeSwapRule,
     CommutativeSwapRule,
@@ -35,8 +43,8 @@ class MathyEnv:
     verbose: bool
     reward_discount: float
     parser: ExpressionParser
-    valid_actions_mask_cache: Dict[str, List[int]]
-    valid_rules_cache: Dict[str, List[int]]
+    rule_dispatch: RuleDispatch
+    rule_matches_cache: LRUCache[int, CachedRuleMatches]
 
     def __init__(
         self,
@@ -45,18 +53,37 @@ class MathyEnv:
         verbose: bool = False,
         error_invalid: bool = False,
         reward_discount: float = 0.99,
+        parser: Optional[ExpressionParser] = None,
+        matches_cache_size: int = 4096,
+        share_matches_cache: bool = False,
     ):
+        """Create an environment.
+
+        Pass a `parser` to share it (and its parse caches) between many
+        environments, e.g. one per worker thread. Each environment gets its own
+        parser if none is given.
+
+        The valid actions and rules of each expression are kept in
+        `rule_matches_cache` across episodes, for the `matches_cache_size` most
+        recently used expressions. Set `share_matches_cache` to share the cache
+        with all the environments in the process that have the same rules (see
+        #get_shared_matches_cache), e.g. many gym envs of the same topic."""
         self.discount = reward_discount
         self.verbose = verbose
         self.max_moves = max_moves
         self.error_invalid = error_invalid
-        self.parser = ExpressionParser()
+        self.parser = parser if parser is not None else ExpressionParser()
         if rules is None:
             self.rules = MathyEnv.core_rules()
         else:
             self.rules = rules
-        self.valid_actions_mask_cache = dict()
-        self.valid_rules_cache = dict()
+        self.rule_dispatch = RuleDispatch(self.rules)
+        if share_matches_cache:
+            self.rule_matches_cache = get_shared_matches_cache(
+                self.rules, matches_cache_size
+            )
+        else:
+            self.rule_matches_cache = LRUCache(matches_cache_size)
 
     @classmethod
     def core_rules(cls, preferred_term_commute: bool = False) -> List[BaseRule]:
@@ -168,16 +195,25 @@ class MathyEnv:
 
         # Parameters
             env_state: current env_state
-            searching: True when called by MCTS simulation
+            searching: True when called by MCTS simulation, which only reads the
+                reward and step type. The observation of the time step is
+                then only built if it is read (see #TimeStep).
 
         # Returns
             transition: the current state value transition
         """
         agent = env_state.agent
-        expression = self.parser.parse(agent.problem)
-        features = env_state.to_observation(
-            self.get_valid_moves(env_state), parser=self.parser
-        )
+        expression = agent.get_expression(self.parser)
+        features: MathyObservation
+        if searching:
+            # Reads of its attributes build the observation, so transition_fn
+            # implementations can treat it as a MathyObservation
+            features = cast(
+                MathyObservation,
+                time_step.LazyObservation(lambda: self.state_to_observation(env_state)),
+            )
+        else:
+            features = self.state_to_observation(env_state)
         root = expression.get_root()
 
         # Subclass specific win conditions happen here. Custom win-conditions
@@ -192,13 +228,8 @@ class MathyEnv:
             return time_step.termination(features, self.get_lose_signal(env_state))
 
         # The agent is penalized for returning to a previous state.
-        for key, group in groupby(
-            sorted([f"{h.raw}" for h in env_state.agent.history])
-        ):
-            list_count = len(list(group))
-            if list_count <= 1 or key != expression.raw:
-                continue
-
+        list_count = agent.get_visits(expression.raw)
+        if list_count > 1:
             # NOTE: the reward is scaled by how many times this state has been visited
             return time_step.transition(
                 features,
@@ -251,7 +282,7 @@ class MathyEnv:
         change: the change descriptor describing the change that happened
         """
         agent = env_state.agent
-        expression = self.parser.parse(agent.problem)
+        expression = agent.get_expression(self.parser)
         action_index, token_index = self.get_action_indices(action)
         token = self.get_token_at_index(expression, token_index)
         operation = self.rules[action_index]
@@ -278,11 +309,12 @@ class MathyEnv:
                 return out_env, transition, ExpressionChangeRule(BaseRule())
 
         change = operation.apply_to(token.clone_from_root())
-        root = change.result.get_root()
+        # The new state freezes the tree, so its matches can be cached with it
+        root = change.result.get_root().freeze()
+        self.cache_changed_rule_matches(expression, change)
         change_name = operation.name
-        out_problem = str(root)
         out_env = env_state.get_out_state(
-            problem=out_problem,
+            problem=root,
             focus=token_index,
             action=action_index,
             moves_remaining=agent.moves_remaining - 1,
@@ -320,7 +352,8 @@ class MathyEnv:
         # Returns
         (bool): A boolean indicating if the state is terminal or not.
         """
-        return is_terminal_transition(self.get_state_transition(env_state))
+        transition = self.get_state_transition(env_state, searching=True)
+        return is_terminal_transition(transition)
 
     def print_history(self, env_state: MathyEnvState) -> None:
         """Render the history of an episode from a given state.
@@ -403,9 +436,6 @@ class MathyEnv:
         """Generate an initial MathyEnvState for an episode"""
         config = params if params is not None else MathyEnvProblemArgs()
         prob: MathyEnvProblem = self.problem_fn(config)
-        self.valid_actions_mask_cache = dict()
-        self.valid_rules_cache = dict()
-        self.parser.clear_cache()
         self.max_moves = self.max_moves_fn(prob, config)
 
         # Build and return the initial state
@@ -421,24 +451,17 @@ class MathyEnv:
 
     def get_agent_actions_count(self, env_state: MathyEnvState) -> int:
         """Return number of all possible actions"""
-        node_count = len(self.parser.parse(env_state.agent.problem).to_list())
+        node_count = env_state.agent.get_expression(self.parser).size
         return self.action_size * node_count
 
     def get_token_at_index(
         self, expression: MathExpression, index: int
     ) -> Optional[MathExpression]:
-        """Get the token that is `index` from the left of the expression"""
-        count = 0
-        result = None
-
-        def visit_fn(node, depth, data):
-            nonlocal result, count
-            result = node
-            if count == index:
-                return STOP
-            count = count + 1
-
-        expression.visit_inorder(visit_fn)
+        """Get the token that is `index` from the left of the expression. Indices
+        that are out of range give the last token."""
+        result = expression.get_node_at_index(index)
+        if result is None:
+            result = expression.get_node_at_index(expression.size - 1)
         return result
 
     def get_valid_moves(self, env_state: MathyEnvState) -> List[int]:
@@ -447,7 +470,7 @@ class MathyEnv:
          for the current state.
         """
         agent = env_state.agent
-        expression = self.parser.parse(agent.problem)
+        expression = agent.get_expression(self.parser)
         return self.get_actions_for_node(expression)
 
     def get_valid_rules(self, env_state: MathyEnvState) -> List[int]:
@@ -460,16 +483,11 @@ class MathyEnv:
             If you want to get a list of which nodes each rule can be
             applied to, prefer to use the `get_valid_moves` method.
         """
-        key = self.to_hash_key(env_state)
-        if key in self.valid_rules_cache:
-            return self.valid_rules_cache[key]
-        expression = self.parser.parse(env_state.agent.problem)
-        actions = [0] * len(self.rules)
-        for rule_index, rule in enumerate(self.rules):
-            nodes = rule.find_nodes(expression)
-            actions[rule_index] = 0 if len(nodes) == 0 else 1
-        self.valid_rules_cache[key] = actions[:]
-        return actions
+        expression = env_state.agent.get_expression(self.parser)
+        matches = self.get_cached_rule_matches(expression)
+        if matches is None:
+            matches = self.cache_rule_matches(expression)
+        return matches.rules[:]
 
     def get_action_indices(self, action: int) -> Tuple[int, int]:
         """Get the normalized action/node_index values from a
@@ -494,10 +512,12 @@ class MathyEnv:
         Action masks are 1d lists of length (nodes * num_rules) where a 0 indicates
         the action is not valid in the current state, and a 1 indicates that it is
         a valid action to take."""
-        key = str(expression)
-        if rule_list is None and key in self.valid_actions_mask_cache:
-            return self.valid_actions_mask_cache[key][:]
-        node_count = len(expression.to_list())
+        if rule_list is None:
+            matches = self.get_cached_rule_matches(expression)
+            if matches is None:
+                matches = self.cache_rule_matches(expression)
+            return matches.actions[:]
+        node_count = expression.size
         rule_count = len(self.rules)
         actions = [0] * rule_count * node_count
         for rule_index, rule in enumerate(self.rules):
@@ -507,10 +527,102 @@ class MathyEnv:
             for node in nodes:
                 action_index = (node.r_index * rule_count) + rule_index
                 actions[action_index] = 1
-        if rule_list is None:
-            self.valid_actions_mask_cache[key] = actions[:]
         return actions
 
-    def to_hash_key(self, env_state: MathyEnvState) -> str:
-        """Convert env_state to a string for MCTS cache"""
-        return env_state.agent.problem
+    def get_cached_rule_matches(
+        self, expression: MathExpression
+    ) -> Optional[RuleMatches]:
+        """Get the cached rule matches of an expression, or None if they aren't
+        in `rule_matches_cache`.
+
+        The cache is keyed by fingerprint, so the expression that the matches
+        were cached for is compared with the given one before they're used.
+
+        # Arguments
+        expression (MathExpression): The expression to get the matches of
+
+        # Returns
+        (Optional[RuleMatches]): The valid actions mask and valid rules for the
+            expression, or None
+        """
+        entry = self.rule_matches_cache.get(expression.fingerprint)
+        if entry is None or not entry.expression.is_identical(expression):
+            return None
+        return entry.matches
+
+    def cache_rule_matches(self, expression: MathExpression) -> RuleMatches:
+        """Match all the env rules against the expression in one pass, and store
+        the valid actions mask and the valid rules vector in `rule_matches_cache`.
+
+        # Arguments
+        expression (MathExpression): The expression to match rules against
+
+        # Returns
+        (RuleMatches): The valid actions mask and valid rules for the expression
+        """
+        matches = match_rules(expression, self.rule_dispatch)
+        self._put_rule_matches(expression, matches)
+        return matches
+
+    def _put_rule_matches(self, expression: MathExpression, matches: RuleMatches):
+        # The cache holds on to the expression, so it must not change. The trees
+        # of env states are already frozen, others are copied.
+        if not expression.frozen:
+            expression = expression.clone().freeze()
+        entry = CachedRuleMatches(expression, matches)
+        self.rule_matches_cache.put(expression.fingerprint, entry)
+
+    def cache_changed_rule_matches(
+        self, previous: MathExpression, change: ExpressionChangeRule
+    ) -> Optional[RuleMatches]:
+        """Update the cached rule matches of an expression after a rule changed
+        it, by only matching the nodes the change could affect.
+
+        Does nothing if the matches of the previous expression are not cached,
+        or those of the changed one already are.
+
+        # Arguments
+        previous (MathExpression): The expression before the change
+        change (ExpressionChangeRule): The change from applying a rule to a
+            clone of `previous`. Its tree is cached with the matches, so freeze
+            it first, or it is copied.
+
+        # Returns
+        (Optional[RuleMatches]): The matches of the changed expression, or None
+            if they were not updated
+        """
+        changed = change.result
+        if changed is None:
+            return None
+        previous_matches = self.get_cached_rule_matches(previous)
+        if previous_matches is None:
+            return None
+        # Follow the path to the changed node to find the subtree it replaced
+        path: List[bool] = []
+        node = changed
+        while node.parent is not None:
+            path.append(node.parent.left is node)
+            node = node.parent
+        root = node
+        if self.get_cached_rule_matches(root) is not None:
+            return None
+        replaced: Optional[MathExpression] = previous
+        for is_left in reversed(path):
+            if replaced is None:
+                break
+            replaced = replaced.left if is_left else replaced.right
+        if replaced is None:
+            return None
+        matches = self.rule_dispatch.rematch(
+            changed, replaced, previous_matches.actions
+        )
+        self._put_rule_matches(root, matches)
+        return matches
+
+    def to_hash_key(self, env_state: MathyEnvState) -> bytes:
+        """Convert env_state to a key for MCTS.
+
+        The key is the #MathExpression.to_bytes encoding of the state's
+        expression, which is exact (unlike the fingerprint) and shorter than
+        the problem text."""
+        return env_state.agent.get_expression(self.parser).to_bytes()
@@ -25,6 +25,9 @@ class AssociativeSwapRule(BaseRule):
            a     b            b     c
         """
 
+    node_types = (AddExpression, MultiplyExpression)
+    match_depth = 0
+
     @property
     def name(self) -> str:
         return "Associative Group"
@@ -27,6 +27,10 @@ class CommutativeSwapRule(BaseRule):
           /     \            /     \
          a       b          b       a
     """
+
+    node_types = (AddExpression, MultiplyExpression)
+    match_depth = 2
+
     preferred: bool
 
     def __init__(self, preferred=True):
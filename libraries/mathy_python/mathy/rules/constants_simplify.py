@@ -14,6 +14,9 @@ class ConstantsSimplifyRule(BaseRule):
     """Given a binary operation on two constants, simplify to the resulting
     constant expression"""
 
+    node_types = (BinaryExpression,)
+    match_depth = 3
+
     @property
     def name(self):
         return "Constant Arithmetic"
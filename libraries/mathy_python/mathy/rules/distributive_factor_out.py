@@ -39,6 +39,10 @@ class DistributiveFactorOutRule(BaseRule):
               / \     / \             / \
              a   b   a   c           b   c
     """
+
+    node_types = (AddExpression,)
+    match_depth = 5
+
     constants: bool
 
     def __init__(self, constants=False):
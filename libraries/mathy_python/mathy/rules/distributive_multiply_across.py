@@ -36,6 +36,9 @@ class DistributiveMultiplyRule(BaseRule):
              b     c      a     b a     c
     """
 
+    node_types = (MultiplyExpression,)
+    match_depth = 1
+
     @property
     def name(self):
         return "Distributive Multiply"
@@ -49,6 +49,10 @@ class VariableMultiplyRule(BaseRule):
               x   d      1   d
 
     """
+
+    node_types = (MultiplyExpression,)
+    match_depth = 4
+
     POS_SIMPLE = "simple"
     POS_CHAINED = "chained"
     POS_CHAINED_LEFT_RIGHT = "chained_left_right"
@@ -1,5 +1,16 @@
 from enum import IntEnum
-from typing import Any, Dict, List, NamedTuple, Optional
+from typing import (
+    Any,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Union,
+    overload,
+)
 
 import numpy as np
 import srsly
@@ -114,6 +125,156 @@ MathyEnvStateStep.action.__doc__ = "the action taken" # noqa
 # fmt: on
 
 
+# The number of steps between the history nodes that store the visit counts of
+# every problem before them, which bounds the work of MathyHistory.get_visits
+HISTORY_VISITS_INTERVAL = 32
+
+
+class _HistoryNode:
+    """One step of a #MathyHistory, linked to the node of the step before it"""
+
+    __slots__ = ("step", "previous", "length", "first", "visits")
+
+    step: MathyEnvStateStep
+    previous: Optional["_HistoryNode"]
+    length: int
+    first: MathyEnvStateStep
+    visits: Optional[Dict[str, int]]
+
+    def __init__(self, step: MathyEnvStateStep, previous: Optional["_HistoryNode"]):
+        self.step = step
+        self.previous = previous
+        if previous is None:
+            self.length = 1
+            self.first = step
+        else:
+            self.length = previous.length + 1
+            self.first = previous.first
+        self.visits = None
+        if self.length % HISTORY_VISITS_INTERVAL == 0:
+            self.visits = _count_visits(self)
+
+
+def _count_visits(node: Optional[_HistoryNode]) -> Dict[str, int]:
+    """Count the visits of every problem up to a node, starting from the
+    counts stored by the nearest node before it"""
+    steps: List[str] = []
+    while node is not None and node.visits is None:
+        steps.append(node.step.raw)
+        node = node.previous
+    visits = dict(node.visits) if node is not None and node.visits else {}
+    for raw in steps:
+        visits[raw] = visits.get(raw, 0) + 1
+    return visits
+
+
+class MathyHistory(Sequence[MathyEnvStateStep]):
+    """The steps that an agent has taken in an episode, oldest first.
+
+    Steps are stored in a persistent linked list from the newest step to the
+    oldest, so copying a history takes constant time and the copies share the
+    steps they have in common. Appending a step to a copy doesn't change the
+    others. The first and last steps and the length are read in constant time,
+    other indices take time proportional to their distance from the end, and
+    slices build a list.
+
+    # Arguments
+    steps (Optional[Iterable[MathyEnvStateStep]]): The initial steps
+    """
+
+    __slots__ = ("_tail",)
+
+    _tail: Optional[_HistoryNode]
+
+    def __init__(self, steps: Optional[Iterable[MathyEnvStateStep]] = None):
+        self._tail = None
+        if steps is not None:
+            for step in steps:
+                self.append(step)
+
+    def append(self, step: MathyEnvStateStep) -> None:
+        """Add a step to the end of this history"""
+        self._tail = _HistoryNode(step, self._tail)
+
+    def copy(self) -> "MathyHistory":
+        """Get a copy of this history that shares its steps"""
+        history = MathyHistory()
+        history._tail = self._tail
+        return history
+
+    def get_visits(self, problem: str) -> int:
+        """Get the number of steps in this history with the given problem text.
+
+        Only the steps after the last node that stores visit counts are
+        searched, which is fewer than #HISTORY_VISITS_INTERVAL steps.
+
+        # Arguments
+        problem (str): The problem text to count the visits of
+
+        # Returns
+        (int): The number of times the problem appears in the history
+        """
+        count = 0
+        node = self._tail
+        while node is not None and node.visits is None:
+            if node.step.raw == problem:
+                count += 1
+            node = node.previous
+        if node is not None and node.visits is not None:
+            count += node.visits.get(problem, 0)
+        return count
+
+    def __len__(self) -> int:
+        return self._tail.length if self._tail is not None else 0
+
+    @overload
+    def __getitem__(self, index: int) -> MathyEnvStateStep:
+        ...
+
+    @overload
+    def __getitem__(self, index: slice) -> List[MathyEnvStateStep]:
+        ...
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return list(self)[index]
+        length = len(self)
+        if index < 0:
+            index += length
+        if index < 0 or index >= length:
+            raise IndexError("history index out of range")
+        node = self._tail
+        assert node is not None
+        if index == 0:
+            return node.first
+        for _ in range(length - 1 - index):
+            node = node.previous
+        return node.step
+
+    def __iter__(self) -> Iterator[MathyEnvStateStep]:
+        steps = list(reversed(self))
+        steps.reverse()
+        return iter(steps)
+
+    def __reversed__(self) -> Iterator[MathyEnvStateStep]:
+        node = self._tail
+        while node is not None:
+            yield node.step
+            node = node.previous
+
+    def __eq__(self, other: Any) -> bool:
+        if isinstance(other, MathyHistory):
+            return self._tail is other._tail or list(self) == list(other)
+        if isinstance(other, (list, tuple)):
+            return list(self) == list(other)
+        return NotImplemented
+
+    __hash__ = None  # type:ignore
+
+    def __repr__(self) -> str:
+        return f"MathyHistory({list(self)})"
+
+
 _problem_hash_cache: Optional[Dict[str, List[int]]] = None
 
 
@@ -182,14 +343,25 @@ class MathyEnvState(object):
         return MathyEnvState(state=self)
 
     def get_out_state(
-        self, problem: str, focus: int, action: int, moves_remaining: int
+        self,
+        problem: Union[str, MathExpression],
+        focus: int,
+        action: int,
+        moves_remaining: int,
     ) -> "MathyEnvState":
         """Get the next environment state based on the current one with updated
-        history and agent information based on an action being taken."""
+        history and agent information based on an action being taken.
+
+        The `problem` can be given as text, or as an expression tree that the new
+        state carries so that it doesn't need to be parsed again. Trees are
+        frozen, because they are shared by copies of the state."""
         out_state = MathyEnvState.copy(self)
         agent = out_state.agent
-        agent.history.append(MathyEnvStateStep(problem, focus, action))
-        agent.problem = problem
+        if isinstance(problem, MathExpression):
+            agent.expression = problem
+        else:
+            agent.problem = problem
+        agent.history.append(MathyEnvStateStep(agent.problem, focus, action))
         agent.action = action
         agent.moves_remaining = moves_remaining
         return out_state
@@ -239,22 +411,19 @@ class MathyEnvState(object):
         parser: Optional[ExpressionParser] = None,
     ) -> MathyObservation:
         """Convert a state into an observation"""
-        if parser is None:
-            parser = ExpressionParser()
         if hash_type is None:
             hash_type = self.get_problem_hash()
-        expression = parser.parse(self.agent.problem)
-        nodes: List[MathExpression] = expression.to_list()
+        expression = self.agent.get_expression(parser)
         vectors: NodeIntList = []
         values: NodeValuesFloatList = []
-        if move_mask is None:
-            move_mask = np.zeros(len(nodes))
-        for node in nodes:
+        for node in expression.iter_preorder():
             vectors.append(node.type_id)
             if isinstance(node, ConstantExpression):
                 values.append(float(node.value))
             else:
                 values.append(0.0)
+        if move_mask is None:
+            move_mask = np.zeros(len(vectors))
 
         return MathyObservation(
             nodes=vectors, mask=move_mask, values=values, type=hash_type
@@ -310,31 +479,120 @@ class MathyEnvState(object):
 
 
 class MathyAgentState:
-    """The state related to an agent for a given environment state"""
+    """The state related to an agent for a given environment state.
+
+    The problem is stored as text, as an expression tree, or both. When only
+    the tree is known the text is rendered the first time that `problem` is
+    read, and when only the text is known it is parsed the first time that
+    #MathyAgentState.get_expression is called.
+
+    The history is a #MathyHistory, which copies of the state share, so that
+    copying a state doesn't copy the steps taken to reach it. Lists assigned to
+    it are converted."""
 
     moves_remaining: int
-    problem: str
     problem_type: str
     reward: float
-    history: List[MathyEnvStateStep]
+    _history: MathyHistory
+    _problem: Optional[str]
+    _expression: Optional[MathExpression]
 
     def __init__(
-        self, moves_remaining, problem, problem_type, reward=0.0, history=None,
+        self,
+        moves_remaining,
+        problem,
+        problem_type,
+        reward=0.0,
+        history=None,
+        expression: Optional[MathExpression] = None,
     ):
         self.moves_remaining = moves_remaining
-        self.problem = problem
+        self._problem = problem
+        self._expression = None
+        if expression is not None:
+            self.expression = expression
+            self._problem = problem
+        if problem is None and expression is None:
+            raise ValueError("either a problem or an expression must be given")
         self.reward = reward
         self.problem_type = problem_type
         self.history = (
-            history[:] if history is not None else [MathyEnvStateStep(problem, -1, -1)]
+            history
+            if history is not None
+            else [MathyEnvStateStep(self.problem, -1, -1)]
         )
 
+    @property
+    def history(self) -> MathyHistory:
+        """The steps taken in the episode, starting with the initial problem"""
+        return self._history
+
+    @history.setter
+    def history(self, value: Iterable[MathyEnvStateStep]) -> None:
+        if isinstance(value, MathyHistory):
+            self._history = value.copy()
+        else:
+            self._history = MathyHistory(value)
+
+    @property
+    def problem(self) -> str:
+        """The text of the problem"""
+        if self._problem is None:
+            assert self._expression is not None
+            self._problem = str(self._expression)
+        return self._problem
+
+    @problem.setter
+    def problem(self, value: str) -> None:
+        if value != self._problem:
+            self._expression = None
+        self._problem = value
+
+    @property
+    def expression(self) -> Optional[MathExpression]:
+        """The (frozen) expression tree of the problem, or None if the problem
+        has only been given as text and not parsed yet"""
+        return self._expression
+
+    @expression.setter
+    def expression(self, value: MathExpression) -> None:
+        # Freezing visits every node, so trees that are already frozen are kept
+        self._expression = value if value.frozen else value.freeze()
+        self._problem = None
+
+    def get_expression(
+        self, parser: Optional[ExpressionParser] = None
+    ) -> MathExpression:
+        """Get the expression tree of the problem, parsing the problem text with
+        the given parser if the tree isn't known yet.
+
+        # Arguments
+        parser (Optional[ExpressionParser]): The parser to use, or None to create one
+
+        # Returns
+        (MathExpression): The (frozen) expression tree of the problem
+        """
+        if self._expression is None:
+            if parser is None:
+                parser = ExpressionParser()
+            expression = parser.parse(self.problem)
+            # Trees from a parser without a cache aren't frozen
+            self._expression = expression if expression.frozen else expression.freeze()
+        return self._expression
+
+    def get_visits(self, problem: str) -> int:
+        """Get the number of steps in the history with the given problem text.
+        See #MathyHistory.get_visits."""
+        return self._history.get_visits(problem)
+
     @classmethod
     def copy(cls, from_state: "MathyAgentState"):
-        return MathyAgentState(
+        state = MathyAgentState(
             moves_remaining=from_state.moves_remaining,
-            problem=from_state.problem,
+            problem=from_state._problem,
             reward=from_state.reward,
             problem_type=from_state.problem_type,
             history=from_state.history,
+            expression=from_state._expression,
         )
+        return state
@@ -70,8 +70,9 @@ def run_rule_tests(name, rule_class, callback=None):
         if callback is not None:
             callback(ex)
         rule = init_rule_for_test(ex, rule_class)
-        expression = parser.parse(ex["input"]).clone()
-        before = expression.clone()
+        # Parsed trees are shared, so the rule is applied to a clone
+        before = parser.parse(ex["input"])
+        expression = before.clone()
         print(ex)
         if "target" in ex:
             target = ex["target"]
@@ -101,7 +102,7 @@ def run_rule_tests(name, rule_class, callback=None):
         if callback is not None:
             callback(ex)
         rule = init_rule_for_test(ex, rule_class)
-        expression = parser.parse(ex["input"]).clone()
+        expression = parser.parse(ex["input"])
         node = rule.find_node(expression)
         if node is not None:
             raise ValueError(
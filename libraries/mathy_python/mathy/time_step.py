@@ -18,6 +18,8 @@
 #
 #  - 2019/12/09 JD: inline and remove tensorflow dependency/shape support
 #  - 2019/12/11 JD: add MathyObservation type hints
+#  - 2026/10/18: add LazyObservation for search steps that rarely read observations,
+#    and build it on any read of the TimeStep observation
 """TimeStep representing a step in the environment.
 
 This file is a mostly direct copy of the implementation from the
@@ -35,16 +37,112 @@ from __future__ import division
 from __future__ import print_function
 
 import collections
+import copy
 import numpy as np
 
 
+def _built_observation(value):
+    """Unpickle a #LazyObservation as the observation that it built"""
+    return value
+
+
+class LazyObservation(object):
+    """An observation that is built by calling `fn` the first time it is read.
+
+    Building observations is expensive, and callers like tree search only need
+    the step type and reward of a transition. The value is built at most once,
+    and public attributes are read from it. Copying or pickling a lazy
+    observation builds it, and gives a copy of the observation itself."""
+
+    __slots__ = ("_fn", "_value")
+
+    def __init__(self, fn):
+        self._fn = fn
+        self._value = None
+
+    @property
+    def built(self):
+        """True if the observation has been built"""
+        return self._fn is None
+
+    def get(self):
+        """Build the observation if needed, and return it"""
+        if self._fn is not None:
+            self._value = self._fn()
+            self._fn = None
+        return self._value
+
+    def __getattr__(self, name):
+        # Only called for attributes that aren't slots. Private and special
+        # names are not forwarded, so protocols like copy and pickle that
+        # look them up on a bare instance get an AttributeError.
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return getattr(self.get(), name)
+
+    def __reduce__(self):
+        return (_built_observation, (self.get(),))
+
+    def __deepcopy__(self, memo):
+        return copy.deepcopy(self.get(), memo)
+
+    def __repr__(self):
+        if self._fn is not None:
+            return "LazyObservation(<not built>)"
+        return "LazyObservation(%r)" % (self._value,)
+
+
+def _get_value(value):
+    """Build the value if it is a #LazyObservation"""
+    if isinstance(value, LazyObservation):
+        return value.get()
+    return value
+
+
 class TimeStep(
     collections.namedtuple(
         "TimeStep", ["step_type", "reward", "discount", "observation"]
     )
 ):
+    """A step in the environment. Steps can be created with a #LazyObservation,
+    which is built the first time the observation is read by any means: the
+    `observation` attribute, indexing, unpacking, `_asdict`, copying or
+    pickling. Only the repr and `_replace` of other fields leave it unbuilt."""
+
     __slots__ = ()
 
+    @property
+    def observation(self):
+        """The observation of the step"""
+        return _get_value(tuple.__getitem__(self, 3))
+
+    def __getitem__(self, index):
+        value = tuple.__getitem__(self, index)
+        if isinstance(index, slice):
+            return tuple(_get_value(v) for v in value)
+        return _get_value(value)
+
+    def __iter__(self):
+        for value in tuple.__iter__(self):
+            yield _get_value(value)
+
+    def __eq__(self, other):
+        return tuple(self) == tuple(other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def _replace(self, **kwargs):
+        # The namedtuple version iterates over the values, which would build a
+        # lazy observation even when it isn't replaced
+        values = [
+            kwargs.pop(name, value)
+            for name, value in zip(self._fields, tuple.__iter__(self))
+        ]
+        if kwargs:
+            raise ValueError("Got unexpected field names: %r" % list(kwargs))
+        return self.__class__(*values)
+
     def is_first(self):
         return np.equal(self.step_type, StepType.FIRST)
 
@@ -3,7 +3,17 @@ import math
 import os
 import re
 from pathlib import Path
-from typing import Any, Dict, List, NamedTuple, Optional, Tuple, Union, cast
+from typing import (
+    Any,
+    Dict,
+    List,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Tuple,
+    Union,
+    cast,
+)
 
 import numpy as np
 from pydantic import BaseModel
@@ -33,7 +43,7 @@ def is_debug_mode() -> bool:
 
 
 def compare_expression_string_values(
-    from_expression: str, to_expression: str, history: Optional[List[Any]] = None
+    from_expression: str, to_expression: str, history: Optional[Sequence[Any]] = None
 ):
     """Compare and evaluate two expressions strings to verify they have the
     same value"""
@@ -44,7 +54,7 @@ def compare_expression_string_values(
 
 
 def raise_with_history(
-    title: str, description: str, history: Optional[List[Any]] = None,
+    title: str, description: str, history: Optional[Sequence[Any]] = None,
 ):
     import traceback
 
@@ -60,9 +70,11 @@ def raise_with_history(
 def compare_expression_values(
     from_expression: MathExpression,
     to_expression: MathExpression,
-    history: Optional[List[Any]] = None,
+    history: Optional[Sequence[Any]] = None,
+    samples: int = 128,
 ):
-    """Compare and evaluate two expressions to verify they have the same value"""
+    """Compare and evaluate two expressions to verify they have the same value
+    at `samples` random points"""
     vars_from: set = set()
     vars_to: set = set()
     for v in from_expression.find_type(VariableExpression):
@@ -90,21 +102,35 @@ def compare_expression_values(
         )
 
     # Generate random values for each variable, and then evaluate the expressions
-    eval_context: Dict[str, float] = {}
+    # at all of the points at once.
+    eval_context: Dict[str, np.ndarray] = {}
     for var in vars_from:
-        eval_context[var] = float(np.random.randint(1, 100))
+        eval_context[var] = np.random.randint(1, 100, size=samples).astype("float64")
 
-    value_from = from_expression.evaluate(eval_context)
-    value_to = to_expression.evaluate(eval_context)
+    values_from, values_to = np.broadcast_arrays(
+        from_expression.compile()(eval_context), to_expression.compile()(eval_context)
+    )
+    # Same tolerance as math.isclose(rel_tol=1e-9), treating points where both
+    # sides are undefined as equal.
+    with np.errstate(all="ignore"):
+        close = (values_from == values_to) | (
+            np.abs(values_from - values_to)
+            <= 1e-9 * np.maximum(np.abs(values_from), np.abs(values_to))
+        )
+    close |= np.isnan(values_from) & np.isnan(values_to)
 
     # Print out the problem steps leading up to error result.
-    if not math.isclose(value_from, value_to, rel_tol=1e-9, abs_tol=0.0):
+    if not np.all(close):
+        index = int(np.argmin(close))
+        value_from = values_from.flat[index]
+        value_to = values_to.flat[index]
+        point = {var: eval_context[var][index] for var in sorted_from}
         changed = f"""
         {from_expression} = {value_from}
 
         {to_expression} = {value_to}
 
-        {value_from} != {value_to}
+        {value_from} != {value_to} at {point}
         """
         raise_with_history("Expression value changed", changed, history)
 
@@ -412,20 +438,19 @@ def get_term(node: MathExpression) -> Union[TermResult, Literal[False]]:
 
     # TODO: Comment resolution on whether +- is OKAY, and if not, why it breaks down.
     if not is_add_or_sub(node):
-        if (
-            len(node.find_type(AddExpression)) > 0
-            or len(node.find_type(SubtractExpression)) > 0
+        if node.contains_type(AddExpression) or node.contains_type(
+            SubtractExpression
         ):
             return False
 
     # If another add is found on the left side of this node, and the right node
     # is _NOT_ a leaf, we cannot extract a term.  If it is a leaf, the term should be
     # just the right node.
-    if node.left and len(node.left.find_type(AddExpression)) > 0:
+    if node.left and node.left.contains_type(AddExpression):
         if node.right and not node.right.is_leaf():
             return False
 
-    if node.right and len(node.right.find_type(AddExpression)) > 0:
+    if node.right and node.right.contains_type(AddExpression):
         return False
 
     exponents = node.find_type(PowerExpression)
@@ -654,16 +679,13 @@ def get_terms(expression: MathExpression) -> List[MathExpression]:
     if isinstance(root, MultiplyExpression):
         results.append(root)
 
-    def visit_fn(node, depth, data):
-        nonlocal results
+    for node in root.iter_inorder():
         if not is_add_or_sub(node):
-            return
+            continue
         if not is_add_or_sub(node.left):
             results.append(node.left)
         if not is_add_or_sub(node.right):
             results.append(node.right)
-
-    root.visit_inorder(visit_fn)
     return [expression] if len(results) == 0 else results
 
 
@@ -0,0 +1,55 @@
+import threading
+
+import pytest
+
+from mathy.core.cache import LRUCache
+
+
+def test_cache_lru_eviction():
+    cache: LRUCache[str, int] = LRUCache(capacity=2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1
+    cache.put("c", 3)
+    # "b" was the least recently used
+    assert "b" not in cache
+    assert cache.get("b") is None
+    assert cache.get("c") == 3
+    assert len(cache) == 2
+    stats = cache.stats
+    assert (stats.hits, stats.misses, stats.evictions) == (2, 1, 1)
+    assert stats.size == 2 and stats.capacity == 2
+    assert stats.hit_rate == pytest.approx(2 / 3)
+    # Clearing keeps the counters, resetting clears them
+    cache.clear()
+    assert len(cache) == 0 and cache.stats.hits == 2
+    cache.reset_stats()
+    assert cache.stats.hits == 0 and cache.stats.hit_rate == 0.0
+
+
+def test_cache_disabled_and_errors():
+    cache: LRUCache[str, int] = LRUCache(capacity=0)
+    cache.put("a", 1)
+    assert cache.get("a", -1) == -1
+    assert cache.stats.misses == 1
+    with pytest.raises(ValueError):
+        LRUCache(capacity=-1)
+
+
+def test_cache_threads():
+    cache: LRUCache[int, int] = LRUCache(capacity=64)
+
+    def worker(offset: int):
+        for i in range(2000):
+            key = (i + offset) % 100
+            if cache.get(key) is None:
+                cache.put(key, key)
+
+    threads = [threading.Thread(target=worker, args=(i * 7,)) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    stats = cache.stats
+    assert stats.size <= 64
+    assert stats.hits + stats.misses == 8000
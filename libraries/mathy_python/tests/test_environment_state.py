@@ -55,3 +55,91 @@ def test_env_state_to_observation():
     """to_observation has defaults to allow calling with no arguments"""
     env_state = MathyEnvState(problem="4x+2")
     assert env_state.to_observation() is not None
+
+
+def test_env_state_carries_expression():
+    from mathy import ExpressionParser
+
+    parser = ExpressionParser()
+    env_state = MathyEnvState(problem="4x+2")
+    assert env_state.agent.expression is None
+    expression = env_state.agent.get_expression(parser)
+    assert expression is parser.parse("4x+2")
+    assert env_state.agent.expression is expression
+    # States can be given a tree, and render its text when it is read
+    tree = parser.parse("2 + 4x").clone()
+    out_state = env_state.get_out_state(
+        problem=tree, focus=1, moves_remaining=9, action=0
+    )
+    agent = out_state.agent
+    assert agent.expression is tree and tree.frozen
+    assert agent.get_expression(parser) is tree
+    assert agent.problem == "2 + 4x"
+    assert agent.history[-1].raw == "2 + 4x"
+    # Copies share the tree, and setting the text drops it
+    copy = MathyEnvState.copy(out_state)
+    assert copy.agent.expression is tree
+    copy.agent.problem = "4x"
+    assert copy.agent.expression is None
+    assert out_state.agent.expression is tree
+    # Persistence is unchanged
+    compare = MathyEnvState.from_string(out_state.to_string())
+    assert compare.agent.problem == "2 + 4x"
+    assert compare.to_string() == out_state.to_string()
+
+
+def test_env_state_visits():
+    from mathy.state import MathyEnvStateStep
+
+    env_state = MathyEnvState(problem="4x+2")
+    assert env_state.agent.get_visits("4x+2") == 1
+    state = env_state
+    for problem in ["2 + 4x", "4x + 2", "2 + 4x"]:
+        state = state.get_out_state(problem, focus=1, action=0, moves_remaining=9)
+    agent = state.agent
+    assert agent.get_visits("2 + 4x") == 2
+    assert agent.get_visits("4x + 2") == 1
+    assert agent.get_visits("x") == 0
+    # States don't share their counts
+    assert env_state.agent.get_visits("2 + 4x") == 0
+    copy = MathyEnvState.copy(state)
+    copy.agent.history.append(MathyEnvStateStep("4x + 2", 1, 0))
+    assert copy.agent.get_visits("4x + 2") == 2
+    assert agent.get_visits("4x + 2") == 1
+    # Replacing the history counts it again
+    copy.agent.history = copy.agent.history[:1]
+    assert copy.agent.get_visits("4x + 2") == 0
+    assert copy.agent.get_visits("4x+2") == 1
+    loaded = MathyEnvState.from_string(state.to_string())
+    assert loaded.agent.get_visits("2 + 4x") == 2
+
+
+def test_env_state_history_shared():
+    from mathy.state import HISTORY_VISITS_INTERVAL, MathyEnvStateStep, MathyHistory
+
+    problems = ["4x+2", "2 + 4x", "4x + 2"]
+    state = MathyEnvState(problem=problems[0])
+    steps = [state.agent.history[0]]
+    for i in range(HISTORY_VISITS_INTERVAL * 2 + 5):
+        problem = problems[(i + 1) % len(problems)]
+        state = state.get_out_state(problem, focus=i, action=0, moves_remaining=9)
+        steps.append(MathyEnvStateStep(problem, i, 0))
+    history = state.agent.history
+    assert isinstance(history, MathyHistory)
+    assert len(history) == len(steps)
+    assert history == steps
+    assert list(history) == steps
+    assert history[:3] == steps[:3]
+    for i in [0, 1, 31, 32, 33, -1, -2, -len(steps)]:
+        assert history[i] == steps[i]
+    for problem in problems:
+        expected = len([s for s in steps if s.raw == problem])
+        assert state.agent.get_visits(problem) == expected
+    # Copies share their steps, and appending to one doesn't change the other
+    copy = MathyEnvState.copy(state)
+    assert copy.agent.history is not history
+    copy.agent.history.append(MathyEnvStateStep("x", 0, 0))
+    assert len(copy.agent.history) == len(steps) + 1
+    assert len(history) == len(steps)
+    assert copy.agent.get_visits("x") == 1
+    assert state.agent.get_visits("x") == 0
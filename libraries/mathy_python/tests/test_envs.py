@@ -1,6 +1,10 @@
 from mathy.state import MathyEnvState
+from mathy.core.parser import ExpressionParser
 from mathy.env import MathyEnv
+from mathy.envs.binomial_distribute import BinomialDistribute
+from mathy.envs.complex_simplify import ComplexSimplify
 from mathy.envs.poly_simplify import PolySimplify
+from mathy.types import MathyEnvDifficulty, MathyEnvProblemArgs
 from mathy.util import is_terminal_transition, EnvRewards
 import random
 import pytest
@@ -16,6 +20,146 @@ def test_mathy_env_init():
         env.get_env_namespace()
 
 
+def test_mathy_env_shared_parser():
+    parser = ExpressionParser()
+    envs = [PolySimplify(parser=parser) for _ in range(2)]
+    assert all(env.parser is parser for env in envs)
+    assert PolySimplify().parser is not parser
+
+
+def test_mathy_env_rule_matches_cache():
+    env = PolySimplify(matches_cache_size=2)
+    env_state, _ = env.get_initial_state()
+    env.get_valid_moves(env_state)
+    env.get_valid_rules(env_state)
+    stats = env.rule_matches_cache.stats
+    assert stats.misses == 1 and stats.hits == 1
+    # The cache is kept between episodes
+    key = env_state.agent.get_expression(env.parser).fingerprint
+    env.get_initial_state()
+    assert key in env.rule_matches_cache
+    # And holds at most matches_cache_size expressions
+    for text in ["4x + 2x", "2y * 3y", "7 + 4"]:
+        env.get_valid_moves(MathyEnvState(problem=text))
+    assert len(env.rule_matches_cache) == 2
+    assert env.rule_matches_cache.stats.evictions > 0
+
+
+def test_mathy_env_rule_matches_cache_collision():
+    from mathy.core.rule import match_rules
+
+    env = PolySimplify()
+    cached = MathyEnvState(problem="4x + 2x")
+    env.get_valid_moves(cached)
+    # Give another expression the same fingerprint, like a hash collision
+    # would. It doesn't get the cached matches of the first one.
+    env_state = MathyEnvState(problem="4x * 2")
+    expression = env_state.agent.get_expression(env.parser)
+    expression._fingerprint = cached.agent.get_expression(env.parser).fingerprint
+    expected = match_rules(expression, env.rules)
+    assert env.get_valid_moves(env_state) == expected.actions
+    assert env.get_valid_rules(env_state) == expected.rules
+
+
+def test_mathy_env_shared_rule_matches_cache():
+    shared = [PolySimplify(share_matches_cache=True) for _ in range(2)]
+    assert shared[0].rule_matches_cache is shared[1].rule_matches_cache
+    # Envs with the same rules share the cache
+    env = ComplexSimplify(share_matches_cache=True)
+    assert env.rule_matches_cache is shared[0].rule_matches_cache
+    env_state = MathyEnvState(problem="4x + 2x + 7")
+    shared[0].get_valid_moves(env_state)
+    key = env_state.agent.get_expression(env.parser).fingerprint
+    assert env.rule_matches_cache.get(key) is not None
+    # But not with envs that have other rules, or that don't share
+    rules = MathyEnv.core_rules(preferred_term_commute=True)
+    other = MathyEnv(rules=rules, share_matches_cache=True)
+    assert other.rule_matches_cache is not env.rule_matches_cache
+    assert PolySimplify().rule_matches_cache is not env.rule_matches_cache
+
+
+@pytest.mark.parametrize(
+    "env_class", [PolySimplify, ComplexSimplify, BinomialDistribute]
+)
+def test_mathy_env_incremental_rule_matches(env_class):
+    from mathy.core.rule import match_rules
+
+    random.seed(1337)
+    env = env_class()
+    args = MathyEnvProblemArgs(difficulty=MathyEnvDifficulty.hard)
+    steps = 0
+    for _ in range(3):
+        env_state, _ = env.get_initial_state(args)
+        for _ in range(5):
+            valid = [i for i, v in enumerate(env.get_valid_moves(env_state)) if v]
+            if not valid:
+                break
+            # Valid actions update the mask incrementally, and it is the same
+            # as matching the whole changed expression
+            for action in random.sample(valid, min(len(valid), 10)):
+                next_state, _, _ = env.get_next_state(env_state, action)
+                expression = next_state.agent.get_expression(env.parser)
+                assert expression.fingerprint in env.rule_matches_cache
+                expected = match_rules(expression, env.rules)
+                assert env.get_valid_moves(next_state) == expected.actions
+                assert env.get_valid_rules(next_state) == expected.rules
+                steps += 1
+            env_state, _, _ = env.get_next_state(env_state, random.choice(valid))
+    assert steps > 20
+
+
+def test_mathy_env_incremental_rule_matches_fixtures():
+    from mathy.core.rule import match_rules
+    from mathy.testing import get_rule_tests
+
+    names = [
+        "associative_property",
+        "commutative_property",
+        "constants_simplify",
+        "distributive_factor_out",
+        "distributive_multiply_across",
+        "variable_multiply",
+    ]
+    texts = []
+    for name in names:
+        tests = get_rule_tests(name)
+        texts += [ex["input"] for ex in tests["valid"] + tests["invalid"]]
+    # Changes at the deepest levels that each rule's match_depth covers
+    texts += [
+        "(y + (2 + 3x^(1 + 1))) + 4x^2",
+        "x^2 * (3x^(1 + 1) * y)",
+        "2 + (((1 + 1) + 3) + y)",
+        "(y * x^(1 + 1)) * x^2",
+        "2 * ((1 + 1) * x)",
+    ]
+    # Put the rule examples below other nodes, so changes to them affect their
+    # ancestors and siblings
+    wrappers = ["{}", "({}) * 3", "2x + ({}) + 4x", "y * (2 + ({}) * z)"]
+    env = MathyEnv()
+    for text in texts:
+        for wrapper in wrappers:
+            env_state = MathyEnvState(problem=wrapper.format(text))
+            mask = env.get_valid_moves(env_state)
+            for action in [i for i, v in enumerate(mask) if v]:
+                next_state, _, _ = env.get_next_state(env_state, action)
+                expression = next_state.agent.get_expression(env.parser)
+                expected = match_rules(expression, env.rules)
+                assert env.get_valid_moves(next_state) == expected.actions, text
+
+
+def test_mathy_env_incremental_rule_matches_sibling():
+    env = MathyEnv()
+    env_state = MathyEnvState(problem="4x * (2 * 3)")
+    commute_4x = 1 * len(env.rules) + 1
+    assert env.get_valid_moves(env_state)[commute_4x] == 1
+    # Simplifying "2 * 3" makes the sibling of "4x" a constant, so the
+    # commutative rule no longer applies to it
+    simplify_2_3 = 5 * len(env.rules) + 0
+    env_state, _, _ = env.get_next_state(env_state, simplify_2_3)
+    assert env_state.agent.problem == "4x * 6"
+    assert env.get_valid_moves(env_state)[commute_4x] == 0
+
+
 def test_mathy_env_invalid_action_behaviors():
 
     problem = "4x + 2x"
@@ -71,6 +215,96 @@ def test_mathy_env_terminal_conditions():
         assert text == text and is_terminal_transition(reward) == bool(is_win)
 
 
+def test_mathy_env_transition_lazy_observation():
+    from mathy.state import MathyObservation
+    from mathy.time_step import LazyObservation
+
+    env = PolySimplify()
+    for text in ["4x + 2x", "3x + 2y + 7"]:
+        env_state = MathyEnvState(problem=text)
+        expected = env.state_to_observation(env_state)
+        # Observations are built eagerly by default
+        step_type, reward, discount, observation = env.get_state_transition(env_state)
+        assert isinstance(observation, MathyObservation)
+        assert observation.nodes == expected.nodes
+        # Searching builds the observation only if it is read
+        transition = env.get_state_transition(env_state, searching=True)
+        lazy = tuple.__getitem__(transition, 3)
+        assert isinstance(lazy, LazyObservation)
+        assert transition.reward == reward and transition.step_type == step_type
+        assert transition._replace(reward=1.0).reward == 1.0
+        assert "not built" in repr(transition)
+        assert not lazy.built
+        observation = transition.observation
+        assert lazy.built
+        assert transition.observation is observation
+        assert observation.nodes == expected.nodes
+        assert observation.mask == expected.mask
+        assert lazy.values == expected.values
+
+
+def test_mathy_env_transition_lazy_observation_access():
+    from mathy.state import MathyObservation
+
+    env = PolySimplify()
+    env_state = MathyEnvState(problem="4x + 2x")
+    expected = env.state_to_observation(env_state)
+    # Every way of reading the observation of a step gives the observation
+    reads = [
+        lambda t: t[3],
+        lambda t: t[-1],
+        lambda t: t[2:][1],
+        lambda t: list(t)[3],
+        lambda t: t._asdict()["observation"],
+        lambda t: t._replace(reward=1.0).observation,
+    ]
+    for read in reads:
+        transition = env.get_state_transition(env_state, searching=True)
+        observation = read(transition)
+        assert isinstance(observation, MathyObservation)
+        assert observation.nodes == expected.nodes
+    step_type, reward, discount, observation = env.get_state_transition(
+        env_state, searching=True
+    )
+    assert isinstance(observation, MathyObservation)
+    assert env.get_state_transition(
+        env_state, searching=True
+    ) == env.get_state_transition(env_state)
+
+
+def test_mathy_env_transition_lazy_observation_copy():
+    import copy
+    import pickle
+
+    from mathy.state import MathyObservation
+    from mathy.time_step import LazyObservation
+
+    env = PolySimplify()
+    env_state = MathyEnvState(problem="4x + 2x")
+    expected = env.state_to_observation(env_state)
+    # Copies and pickles hold the observation itself
+    for copy_fn in [
+        copy.copy,
+        copy.deepcopy,
+        lambda t: pickle.loads(pickle.dumps(t)),
+    ]:
+        transition = env.get_state_transition(env_state, searching=True)
+        copied = copy_fn(transition)
+        assert copied.reward == transition.reward
+        assert isinstance(tuple.__getitem__(copied, 3), MathyObservation)
+        assert copied.observation.nodes == expected.nodes
+    # Lazy observations can also be copied and pickled on their own
+    lazy = LazyObservation(lambda: expected)
+    assert pickle.loads(pickle.dumps(lazy)).nodes == expected.nodes
+    assert copy.deepcopy(lazy).nodes == expected.nodes
+    # Private and special names aren't forwarded to the observation
+    bare = LazyObservation.__new__(LazyObservation)
+    with pytest.raises(AttributeError):
+        bare._fn
+    with pytest.raises(AttributeError):
+        bare.__missing__
+
+
 def test_print_history():
     env = PolySimplify()
     env_state = MathyEnvState(problem="4x+2")
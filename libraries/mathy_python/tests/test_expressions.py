@@ -62,6 +62,249 @@ def test_expressions_clear_classes():
     assert "as_string" not in expr.classes
 
 
+def test_expressions_slots():
+    expr = ExpressionParser().parse("4x^2 + abs(-y) = sgn(2z) / 7")
+    for node in expr.to_list():
+        assert not hasattr(node, "__dict__")
+        # Nothing stored in the side table until it's needed
+        assert node._extra is None
+        assert node.classes == [node.id]
+    assert expr.terminal_text == str(expr)
+    # Rendering with colors doesn't leave side tables behind
+    assert all(node._extra is None for node in expr.to_list())
+
+
+def test_expressions_cached_text():
+    expr = ExpressionParser().parse("4x + 2y * (3 - z)").clone()
+    assert str(expr) == "4x + 2y * (3 - z)"
+    assert all(node._str is not None for node in expr.to_list())
+    # Changing a child clears the cached text up to the root
+    sub: SubtractExpression = expr.find_type(SubtractExpression)[0]
+    sub.set_right(AddExpression(VariableExpression("z"), ConstantExpression(1)))
+    assert str(expr) == "4x + 2y * (3 - (z + 1))"
+    const: ConstantExpression = expr.find_type(ConstantExpression)[0]
+    const.value = 7
+    assert str(expr) == "7x + 2y * (3 - (z + 1))"
+    var: VariableExpression = expr.find_type(VariableExpression)[0]
+    var.identifier = "w"
+    assert str(expr) == "7w + 2y * (3 - (z + 1))"
+    # Moving a subtree changes the parentheses it renders with
+    moved = expr.find_type(SubtractExpression)[0]
+    mult = moved.parent
+    assert str(moved) == "(3 - (z + 1))"
+    mult.set_right(ConstantExpression(2))
+    expr.set_left(moved)
+    assert str(expr) == "3 - (z + 1) + 2y * 2"
+    assert str(expr) == str(expr.clone())
+    # Colored output isn't cached
+    expr.all_changed()
+    assert expr.terminal_text != str(expr)
+    assert str(expr) == "3 - (z + 1) + 2y * 2"
+    # Rendering a subtree with colors doesn't leave stale text on its ancestors
+    expr = expr.clone()
+    sub = expr.left
+    const = sub.right.right
+    sub.all_changed()
+    assert str(expr) == "3 - (z + 1) + 2y * 2"
+    assert "\x1b[" in sub.terminal_text
+    const.value = 5
+    assert str(expr) == "3 - (z + 5) + 2y * 2"
+
+
+def test_expressions_fingerprint():
+    parser = ExpressionParser()
+    expr = parser.parse("4x + 2y * (3 - z)").clone()
+    assert expr.fingerprint == expr.clone().fingerprint
+    assert expr.fingerprint == ExpressionParser().parse(str(expr)).fingerprint
+    for other in ["4x + 2y * (3 - y)", "4x + 2Y * (3 - z)", "4.5x + 2y * (3 - z)"]:
+        assert expr.fingerprint != parser.parse(other).fingerprint
+    # Changes only rehash the changed node and its ancestors
+    before = expr.fingerprint
+    sub: SubtractExpression = expr.find_type(SubtractExpression)[0]
+    left_fingerprint = expr.left.fingerprint
+    sub.right.identifier = "y"
+    assert expr._fingerprint is None and sub._fingerprint is None
+    assert expr.left._fingerprint == left_fingerprint
+    assert expr.fingerprint == parser.parse("4x + 2y * (3 - y)").fingerprint
+    sub.right.identifier = "z"
+    assert expr.fingerprint == before
+
+
+@pytest.mark.parametrize(
+    "one,two",
+    [
+        ("x + -1", "x + -2"),
+        ("4x * -1", "4x * -2"),
+        ("-1x", "-2x"),
+        ("x^-1", "x^-2"),
+        ("x + 2305843009213693951", "x + 0"),
+    ],
+)
+def test_expressions_fingerprint_exact_values(one: str, two: str):
+    from mathy import MathyEnvState
+    from mathy.envs import PolySimplify
+
+    # The constants in each pair have equal Python hashes
+    parser = ExpressionParser()
+    assert parser.parse(one).fingerprint != parser.parse(two).fingerprint
+    env = PolySimplify()
+    assert env.to_hash_key(MathyEnvState(problem=one)) != env.to_hash_key(
+        MathyEnvState(problem=two)
+    )
+
+
+def test_expressions_fingerprint_number_types():
+    assert ConstantExpression(2).fingerprint != ConstantExpression(2.0).fingerprint
+    assert ConstantExpression(0.0).fingerprint != ConstantExpression(-0.0).fingerprint
+
+
+def test_expressions_is_identical():
+    parser = ExpressionParser()
+    expr = parser.parse("4x + 2y * (3 - z)")
+    assert expr.is_identical(expr)
+    assert expr.is_identical(expr.clone())
+    for other in ["4x + 2y * (3 - y)", "4x + 2y * (3 - z) + 1", "4.0x + 2y * (3 - z)"]:
+        assert not expr.is_identical(parser.parse(other))
+    # Trees are compared node by node when the fingerprints are the same
+    same_hash = parser.parse("4x + 2y * (3 - y)").clone()
+    same_hash._fingerprint = expr.fingerprint
+    assert not expr.is_identical(same_hash)
+
+
+def test_expressions_size_and_inorder_index():
+    expr = ExpressionParser().parse("4x^2 + 2y * (3 - z)").clone()
+    nodes = expr.to_list("inorder")
+    assert expr.size == len(nodes)
+    for i, node in enumerate(nodes):
+        assert expr.get_node_at_index(i) is node
+        assert node.get_inorder_index() == i
+        assert node.size == len(node.to_list())
+    assert expr.get_node_at_index(len(nodes)) is None
+    assert expr.get_node_at_index(-1) is None
+    # Sizes update when the tree changes
+    sub = expr.find_type(SubtractExpression)[0]
+    sub.set_right(AddExpression(VariableExpression("z"), ConstantExpression(1)))
+    nodes = expr.to_list("inorder")
+    assert expr.size == len(nodes)
+    for i, node in enumerate(nodes):
+        assert expr.get_node_at_index(i) is node
+        assert node.get_inorder_index() == i
+
+
+def test_expressions_contains_type():
+    expr = ExpressionParser().parse("4x^2 + 2y * (3 - z)").clone()
+    mult = expr.find_type(MultiplyExpression)[0]
+    assert expr.contains_type(SubtractExpression)
+    assert expr.contains_type(BinaryExpression)
+    assert not mult.contains_type(SubtractExpression)
+    assert mult.contains_type(PowerExpression)
+    assert not expr.contains_type(AbsExpression)
+    # Masks update when the tree changes
+    mult.set_right(AbsExpression(VariableExpression("x")))
+    assert expr.contains_type(AbsExpression)
+    assert expr.contains_type(UnaryExpression)
+    assert not expr.contains_type(PowerExpression)
+    assert expr.find_type(PowerExpression) == []
+    assert [str(n) for n in expr.find_type(VariableExpression)] == ["x", "y", "z"]
+
+
+@pytest.mark.parametrize(
+    "text",
+    [
+        "4x^2 + 2y * (3 - z)",
+        "-(x - 7) / (y - 3) + 2.5",
+        "x / (y - y) + 4",
+        "(x + 2)^3 - -y",
+    ],
+)
+def test_expressions_compile(text: str):
+    import numpy as np
+
+    expr = ExpressionParser().parse(text).clone()
+    context = {
+        "x": np.arange(-5.0, 5.0),
+        "y": np.arange(10.0, 0.0, -1.0),
+        "z": np.full(10, 2.5),
+    }
+    # Functions aren't parsed, so include them by wrapping the expression
+    for expr in [expr, AbsExpression(expr), SgnExpression(expr)]:
+        values = expr.compile()(context)
+        assert values.shape == (10,)
+        for i in range(10):
+            expected = expr.evaluate({k: v[i] for k, v in context.items()})
+            if np.isnan(expected):
+                assert np.isnan(values[i])
+            else:
+                assert values[i] == pytest.approx(expected)
+
+
+def test_expressions_compile_errors():
+    fn = ExpressionParser().parse("4x + y").compile()
+    with pytest.raises(ValueError):
+        fn({"x": 2.0})
+    assert fn({"x": 2.0, "y": 1.0}) == 9.0
+    # Equal has no value, the same as with evaluate
+    with pytest.raises(ValueError):
+        ExpressionParser().parse("x = 2").compile()({"x": 2.0})
+
+
+@pytest.mark.parametrize(
+    "text",
+    [
+        "4x^2 + 2y * (3 - z)",
+        "-(x - 7) / (y - 3) + 2.5",
+        "12g + -7205x^2 + -4537h^4 + -3522.7j + 10.7a = 0",
+        "X + xy - 100000 * 0.001",
+    ],
+)
+def test_expressions_to_bytes(text: str):
+    expr = ExpressionParser().parse(text)
+    # Functions aren't parsed, so include them by wrapping the expression
+    for expr in [expr, AbsExpression(expr.clone()), SgnExpression(expr.clone())]:
+        data = expr.to_bytes()
+        assert len(data) < len(str(expr))
+        decoded = MathExpression.from_bytes(data)
+        assert str(decoded) == str(expr)
+        assert decoded.fingerprint == expr.fingerprint
+        assert [type(n) for n in decoded.to_list()] == [type(n) for n in expr.to_list()]
+        for node in decoded.to_list():
+            for child in [node.left, node.right]:
+                assert child is None or child.parent is node
+        assert decoded.to_bytes() == data
+
+
+def test_expressions_to_bytes_values():
+    import math
+
+    for value in [0, -64, 63, 64, -(2 ** 15), 2 ** 31, 2 ** 63, -(2 ** 70)]:
+        decoded = MathExpression.from_bytes(ConstantExpression(value).to_bytes())
+        assert decoded.value == value and type(decoded.value) is int
+    for value in [0.0, -0.0, 2.5, -3522.7, 9739.0, 1 / 3, 1e-300, math.inf]:
+        decoded = MathExpression.from_bytes(ConstantExpression(value).to_bytes())
+        assert decoded.value == value and type(decoded.value) is float
+        assert math.copysign(1.0, decoded.value) == math.copysign(1.0, value)
+    for identifier in ["x", "X", "foo", None]:
+        data = VariableExpression(identifier).to_bytes()
+        assert MathExpression.from_bytes(data).identifier == identifier
+    right = NegateExpression(VariableExpression("x"), child_on_left=False)
+    decoded = MathExpression.from_bytes(right.to_bytes())
+    assert decoded.right is not None and decoded.left is None
+
+
+def test_expressions_to_bytes_errors():
+    data = ExpressionParser().parse("4x + 2.5").to_bytes()
+    for bad in [b"", data[:1], data[:-1], data + b"\x00", b"\x09" + data[1:]]:
+        with pytest.raises(ValueError):
+            MathExpression.from_bytes(bad)
+    # Unknown codes
+    with pytest.raises(ValueError):
+        MathExpression.from_bytes(bytes([data[0], 0x7F]))
+    with pytest.raises(ValueError):
+        AddExpression(ConstantExpression(2)).to_bytes()
+    with pytest.raises(ValueError):
+        NegateExpression().to_bytes()
+
+
 @pytest.mark.parametrize(
     "node_instance",
     [
@@ -176,6 +419,23 @@ def test_expressions_clone_root():
     assert expr.evaluate() == 1337
 
 
+def test_expressions_clone_from_root():
+    expr: MathExpression = ExpressionParser().parse("4x + x * (2 + x)")
+    variables = expr.find_type(VariableExpression)
+    assert len(variables) == 3
+    for i, node in enumerate(variables):
+        clone = node.clone_from_root()
+        assert clone is not node
+        assert isinstance(clone, VariableExpression)
+        # The clone is the same node in a copy of the whole tree
+        clone_root = clone.get_root()
+        assert clone_root is not expr
+        assert str(clone_root) == str(expr)
+        assert clone_root.find_type(VariableExpression)[i] is clone
+        # The input tree is untouched
+        assert node.get_root() is expr
+
+
 def test_expressions_function_exceptions():
     x = FunctionExpression()
     with pytest.raises(NotImplementedError):
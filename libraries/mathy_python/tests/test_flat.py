@@ -0,0 +1,89 @@
+import numpy as np
+import pytest
+
+from mathy import (
+    AddExpression,
+    ConstantExpression,
+    ExpressionParser,
+    FlatTree,
+    MathExpression,
+    MultiplyExpression,
+    VariableExpression,
+)
+from mathy.problems import gen_simplify_multiple_terms
+
+
+@pytest.mark.parametrize(
+    "text",
+    [
+        "4x + 2",
+        "4/x^3+2-7x*12=0",
+        "abs(-4) + abs(34)",
+        "-sgn(-1) / sgn(2)",
+        "(2.5x^3 + y)(14 + 2.3y) - 7 * (4 / z)",
+        "X + x",
+    ],
+)
+def test_flat_tree_round_trip(text: str):
+    expression: MathExpression = ExpressionParser().parse(text)
+    flat = FlatTree.from_expression(expression)
+    assert len(flat) == len(expression.to_list())
+    rebuilt = flat.to_expression()
+    assert str(rebuilt) == str(expression)
+    assert [n.type_id for n in rebuilt.to_list()] == flat.type_id.tolist()
+    # Converting again gives identical arrays
+    again = FlatTree.from_expression(rebuilt)
+    for field in ["type_id", "left", "right", "parent", "value", "constant", "symbol"]:
+        assert np.array_equal(getattr(flat, field), getattr(again, field))
+    assert flat.constants == again.constants
+    assert flat.symbols == again.symbols
+
+
+def test_flat_tree_exact_values():
+    big = 2 ** 60 + 1
+    expression = AddExpression(
+        MultiplyExpression(ConstantExpression(big), VariableExpression("rate")),
+        MultiplyExpression(ConstantExpression(2.0), VariableExpression("Rate")),
+    )
+    flat = FlatTree.from_expression(expression)
+    assert flat.symbols == ["rate", "Rate"]
+    rebuilt = flat.to_expression()
+    assert str(rebuilt) == str(expression)
+    constants = [n.value for n in rebuilt.find_type(ConstantExpression)]
+    assert constants == [big, 2.0]
+    assert [type(c) for c in constants] == [int, float]
+    identifiers = [n.identifier for n in rebuilt.find_type(VariableExpression)]
+    assert identifiers == ["rate", "Rate"]
+
+
+def test_flat_tree_links():
+    expression = ExpressionParser().parse("4x + 2")
+    flat = FlatTree.from_expression(expression)
+    nodes = expression.to_list()
+    for i, node in enumerate(nodes):
+        for field in ["left", "right", "parent"]:
+            link = getattr(node, field)
+            index = getattr(flat, field)[i]
+            expected = -1 if link is None else nodes.index(link)
+            assert index == expected
+    # Only constants have values
+    assert flat.value.tolist() == [0.0, 0.0, 4.0, 0.0, 2.0]
+
+
+@pytest.mark.parametrize("visit_order", ["preorder", "inorder", "postorder"])
+def test_flat_tree_get_order(visit_order: str):
+    text, _ = gen_simplify_multiple_terms(8)
+    expression = ExpressionParser().parse(text)
+    flat = FlatTree.from_expression(expression)
+    preorder = expression.to_list()
+    expected = [preorder.index(n) for n in expression.to_list(visit_order)]
+    assert flat.get_order(visit_order).tolist() == expected
+
+
+def test_flat_tree_errors():
+    flat = FlatTree.from_expression(ExpressionParser().parse("4x"))
+    with pytest.raises(ValueError):
+        flat.get_order("invalid")
+    flat.type_id[0] = 0
+    with pytest.raises(ValueError):
+        flat.to_expression()
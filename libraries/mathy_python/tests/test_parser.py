@@ -8,7 +8,13 @@ from mathy.core.parser import (
     TrailingTokens,
     UnexpectedBehavior,
 )
-from mathy.core.tokenizer import Token
+from mathy.core.tokenizer import (
+    Token,
+    TokenConstant,
+    TokenEOF,
+    Tokenizer,
+    TokenVariable,
+)
 from mathy.core.tree import BinaryTreeNode
 
 
@@ -60,3 +66,122 @@ def test_parser_exceptions() -> None:
     for in_str, out_err in expectations:
         with pytest.raises(out_err):
             parser.parse(in_str)
+
+
+def test_parser_tokenizer() -> None:
+    tokenizer = Tokenizer()
+    tokens = tokenizer.tokenize("12.5xy^2 - [z] = 4!")
+    values = [t.value for t in tokens]
+    assert values == ["12.5", "x", "y", "^", "2", "-", "(", "z", ")", "=", "4", "!", ""]
+    assert tokens[0].type == TokenConstant
+    assert tokens[1].type == TokenVariable
+    assert tokens[-1].type == TokenEOF
+    # Long inputs are scanned in a single pass
+    long_tokens = tokenizer.tokenize(" + ".join(["4x^2"] * 5000))
+    assert len(long_tokens) == 5000 * 4 + 4999 + 1
+    with pytest.raises(Exception):
+        tokenizer.tokenize("4x $ 2")
+
+
+def test_parser_bounded_caches() -> None:
+    parser = ExpressionParser(parse_cache_size=2)
+    first = parser.parse("4x + 2")
+    assert parser.parse("4x + 2") is first
+    parser.parse("2y")
+    parser.parse("3z")
+    stats = parser.parse_cache.stats
+    assert stats.size == 2
+    assert (stats.hits, stats.misses, stats.evictions) == (1, 3, 1)
+    # The evicted expression is parsed again
+    assert parser.parse("4x + 2") is not first
+    assert parser.tokens_cache.stats.size == 3
+    # Caches can be disabled
+    uncached = ExpressionParser(parse_cache_size=0, tokens_cache_size=0)
+    assert uncached.parse("4x") is not uncached.parse("4x")
+
+
+def test_parser_frozen_results() -> None:
+    parser = ExpressionParser()
+    expression = parser.parse("4x + 2")
+    assert expression.frozen
+    assert parser.parse("4x + 2") is expression
+    with pytest.raises(ValueError):
+        expression.set_right(ConstantExpression(3))
+    with pytest.raises(ValueError):
+        expression.find_type(ConstantExpression)[0].value = 3
+    with pytest.raises(ValueError):
+        expression.find_type(VariableExpression)[0].identifier = "y"
+    # The cached result is unchanged, and clones can be changed
+    clone = expression.clone()
+    assert not clone.frozen
+    clone.set_right(ConstantExpression(3))
+    assert str(clone) == "4x + 3"
+    assert str(parser.parse("4x + 2")) == "4x + 2"
+    # Without a cache nothing is shared, so trees aren't frozen
+    assert not ExpressionParser(parse_cache_size=0).parse("4x").frozen
+
+
+def test_parser_shared_between_threads() -> None:
+    from concurrent.futures import ThreadPoolExecutor
+
+    from mathy.problems import gen_simplify_multiple_terms
+
+    texts = [gen_simplify_multiple_terms(8)[0] for _ in range(50)]
+    expected = [str(ExpressionParser().parse(t)) for t in texts]
+    # Without caches every thread does a full parse with the shared parser
+    for parser in [ExpressionParser(0, 0), ExpressionParser()]:
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            for _ in range(4):
+                assert list(map(str, pool.map(parser.parse, texts))) == expected
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_parser_parse_many(workers: int, monkeypatch) -> None:
+    import os
+
+    from mathy.core.flat import FlatTree
+
+    # Use a process pool for two workers even on machines with one CPU
+    monkeypatch.setattr(os, "cpu_count", lambda: 2)
+    parser = ExpressionParser()
+    texts = ["4x + 2", "2y", "4x + 2", "4x +", "", "3z^2"]
+    results = parser.parse_many(texts, workers=workers, min_pool_size=1)
+    assert [r.text for r in results] == texts
+    assert [r.ok for r in results] == [True, True, True, False, False, True]
+    assert [str(r.expression) for r in results if r.ok] == [
+        "4x + 2",
+        "2y",
+        "4x + 2",
+        "3z^2",
+    ]
+    assert results[3].expression is None and results[3].error != ""
+    # Duplicates share a frozen result, and other results belong to the caller
+    assert results[0].expression is results[2].expression
+    assert results[0].expression.frozen
+    assert not results[1].expression.frozen
+    # The caches aren't used unless asked for
+    assert parser.parse_cache.stats.size == 0 and parser.tokens_cache.stats.size == 0
+    cached = parser.parse_many(texts, workers=workers, min_pool_size=1, cache=True)
+    # Each unique input is looked up in the cache once
+    assert (parser.parse_cache.stats.hits, parser.parse_cache.stats.misses) == (0, 5)
+    assert cached[1].expression.frozen
+    assert cached[1].expression is parser.parse("2y")
+    flat = ExpressionParser().parse_many(
+        texts, workers=workers, flat=True, min_pool_size=1
+    )
+    assert isinstance(flat[0].expression, FlatTree)
+    assert str(flat[5].expression.to_expression()) == "3z^2"
+    assert flat[4].error == results[4].error
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_parser_parse_many_exact(workers: int, monkeypatch) -> None:
+    import os
+
+    monkeypatch.setattr(os, "cpu_count", lambda: 2)
+    # Trees from the workers have the exact values and names of the inputs
+    texts = ["x + 2305843009213693951", "2.5x + 2.0", "rate * Rate^-1"]
+    expected = [ExpressionParser().parse(t).to_bytes() for t in texts]
+    results = ExpressionParser().parse_many(texts, workers, min_pool_size=1)
+    assert [r.expression.to_bytes() for r in results] == expected
+
@@ -104,3 +104,66 @@ def test_rules_like_terms_compare():
     expr = parser.parse("4z")
     terms = get_terms(expr)
     assert len(terms) == 1
+
+
+def test_rules_match_rules():
+    from mathy.core.rule import match_rules
+    from mathy.env import MathyEnv
+    from mathy.problems import gen_simplify_multiple_terms
+
+    parser = ExpressionParser()
+    rules = MathyEnv.core_rules()
+    texts = ["4x + 2x", "(7 + x) * 2", "4x * 2y^2 + 1 + 2", "x"]
+    texts += [gen_simplify_multiple_terms(8)[0] for _ in range(20)]
+    for text in texts:
+        expression = parser.parse(text)
+        matches = match_rules(expression, rules)
+        # The same as matching each rule with find_nodes
+        expected_actions = [0] * len(rules) * expression.size
+        expected_rules = [0] * len(rules)
+        for rule_index, rule in enumerate(rules):
+            for node in rule.find_nodes(expression):
+                expected_actions[node.r_index * len(rules) + rule_index] = 1
+                expected_rules[rule_index] = 1
+        assert matches.actions == expected_actions
+        assert matches.rules == expected_rules
+
+
+def test_rules_node_types():
+    from mathy.core.rule import RuleDispatch
+    from mathy.env import MathyEnv
+    from mathy.problems import gen_simplify_multiple_terms
+
+    parser = ExpressionParser()
+    rules = MathyEnv.core_rules() + MathyEnv.core_rules(preferred_term_commute=True)
+    texts = ["4x + 2x = 8 - 2 / 3", "(7 + x) * 2^2", "abs(-4) + sgn(2x)"]
+    texts += [gen_simplify_multiple_terms(8)[0] for _ in range(20)]
+    for text in texts:
+        # Rules never apply to nodes outside of their declared node_types
+        for node in parser.parse(text).to_list():
+            for rule in rules:
+                if not isinstance(node, rule.node_types):
+                    assert not rule.can_apply_to(node)
+    # No rule targets leaf nodes, so the dispatch table skips them entirely
+    dispatch = RuleDispatch(rules)
+    assert dispatch.get_checks(VariableExpression) == []
+    # Every rule but DistributiveFactorOut can target a multiply
+    assert len(dispatch.get_checks(type(parser.parse("4 * 2")))) == len(rules) - 2
+
+
+def test_rules_rematch_fingerprint_collision():
+    from mathy.core.rule import RuleDispatch
+    from mathy.env import MathyEnv
+
+    parser = ExpressionParser()
+    dispatch = RuleDispatch(MathyEnv.core_rules())
+    before = parser.parse("x + 2 * 3")
+    after = parser.parse("x + 2 * y").clone()
+    # Give the new subtree the fingerprint of the one it replaced, like a hash
+    # collision would. Its matches aren't copied from the replaced subtree.
+    assert after.right.left.fingerprint and after.right.right.fingerprint
+    after.right._fingerprint = before.right.fingerprint
+    after._fingerprint = None
+    previous = dispatch.match(before).actions
+    matches = dispatch.rematch(after.right, before.right, previous)
+    assert matches == dispatch.match(after)
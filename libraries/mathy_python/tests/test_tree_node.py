@@ -252,3 +252,135 @@ def test_tree_node_get_sibling():
     assert tree.left.get_sibling() == tree.right
     assert tree.right.get_sibling() == tree.left
     assert tree.get_sibling() is None
+
+
+@pytest.mark.parametrize(
+    "order,expected",
+    [
+        ("preorder", [0, -2, -3, -1, 2, 1, 3]),
+        ("inorder", [-3, -2, -1, 0, 1, 2, 3]),
+        ("postorder", [-3, -1, -2, 1, 3, 2, 0]),
+    ],
+)
+def test_tree_node_iter_order(order, expected):
+    tree = BinarySearchTree(0)
+    for i in [-2, -3, -1, 2, 1, 3]:
+        tree.insert(i)
+    keys = [n.key for n in getattr(tree, f"iter_{order}")()]
+    assert keys == expected
+    # The callback visits agree with the iterators
+    visited = []
+    getattr(tree, f"visit_{order}")(lambda n, d, data: visited.append(n.key))
+    assert visited == expected
+
+
+def test_tree_node_iter_early_exit():
+    tree = BinarySearchTree(0)
+    for i in range(-5, 6):
+        tree.insert(i)
+    seen = []
+    for node in tree.iter_inorder():
+        seen.append(node.key)
+        if node.key == -3:
+            break
+    assert seen == [-5, -4, -3]
+
+
+def test_tree_node_visit_depth():
+    values = [-2, -3, -1, 2, 1, 3]
+    tree = BinarySearchTree(0)
+    for i in values:
+        tree.insert(i)
+    expected = {0: 0, -2: 1, 2: 1, -3: 2, -1: 2, 1: 2, 3: 2}
+    for order in ["preorder", "inorder", "postorder"]:
+        depths = {}
+
+        def node_visit(node, depth, data):
+            depths[node.key] = depth
+
+        getattr(tree, f"visit_{order}")(node_visit)
+        assert depths == expected
+
+
+def test_tree_node_deep_traversals():
+    """traversals don't recurse, so very deep trees can be walked"""
+    tree = BinarySearchTree(0)
+    node = tree
+    for i in range(1, 5000):
+        child = BinarySearchTree(i)
+        node.set_right(child)
+        node = child
+    assert len(list(tree.iter_preorder())) == 5000
+    assert len(list(tree.iter_inorder())) == 5000
+    assert len(list(tree.iter_postorder())) == 5000
+    count = 0
+
+    def node_visit(node, depth, data):
+        nonlocal count
+        count += 1
+
+    tree.visit_postorder(node_visit)
+    assert count == 5000
+
+
+def test_tree_node_slots_side_table():
+    """nodes use slots, and optional data lives in a lazily allocated side table"""
+    tree = BinaryTreeNode(BinaryTreeNode(), BinaryTreeNode())
+    assert not hasattr(tree, "__dict__")
+    assert tree._extra is None
+    assert tree.x is None and tree.get_extra("thread", 3) == 3
+    tree.x = 2.0
+    tree.set_extra("thread", tree.left)
+    assert tree.x == 2.0 and tree.get_extra("thread") is tree.left
+    assert tree.left._extra is None
+    # Removing the last value frees the side table
+    assert tree.pop_extra("thread") is tree.left
+    assert tree.pop_extra("thread", 3) == 3
+    assert tree._extra is not None
+    assert tree.pop_extra("x") == 2.0
+    assert tree._extra is None
+    with pytest.raises(AttributeError):
+        tree.unknown_attribute = True
+
+
+def test_tree_node_lazy_ids():
+    """node ids are allocated on first access and are unique across threads"""
+    from concurrent.futures import ThreadPoolExecutor
+
+    node = BinaryTreeNode()
+    assert node._id is None
+    assert node.id.startswith("mn-")
+    assert node.id == node.id
+    # Clones share allocated ids, and allocate their own otherwise
+    assert node.clone().id == node.id
+    unallocated = BinaryTreeNode()
+    clone = unallocated.clone()
+    assert clone.id != unallocated.id
+    assert BinaryTreeNode(id="custom").id == "custom"
+
+    def make_ids(count: int):
+        return [BinaryTreeNode().id for _ in range(count)]
+
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        ids = [i for batch in pool.map(make_ids, [500] * 8) for i in batch]
+    assert len(set(ids)) == len(ids)
+
+
+def test_tree_node_freeze():
+    """frozen trees raise errors when changed, and clones of them are not frozen"""
+    tree = BinarySearchTree(0)
+    for i in [-2, 2, -1, 1]:
+        tree.insert(i)
+    assert tree.freeze() is tree
+    assert all(node.frozen for node in tree.iter_preorder())
+    with pytest.raises(ValueError):
+        tree.set_left(None)
+    with pytest.raises(ValueError):
+        tree.left.right.rotate()
+    # Frozen nodes can't be attached to other trees, because that changes them
+    with pytest.raises(ValueError):
+        BinaryTreeNode().set_right(tree.right)
+    clone = tree.clone()
+    assert not clone.frozen
+    clone.set_left(None)
+    assert tree.left is not None
@@ -1,3 +1,5 @@
+import pytest
+
 from mathy.core.expressions import (
     AddExpression,
     ConstantExpression,
@@ -16,6 +18,7 @@ from mathy.rules import (
 )
 from mathy.util import (
     TermEx,
+    compare_expression_string_values,
     get_sub_terms,
     get_term_ex,
     has_like_terms,
@@ -92,3 +95,13 @@ def test_has_like_terms():
     for input, expected in examples:
         expr = parser.parse(input)
         assert input == input and has_like_terms(expr) == expected
+
+
+def test_compare_expression_string_values():
+    compare_expression_string_values("4x + 2x", "6x")
+    compare_expression_string_values("(x + 1)^2", "x^2 + 2x + 1")
+    # Checked at many points, so values that only match at some don't pass
+    with pytest.raises(ValueError):
+        compare_expression_string_values("x^2", "x * 50")
+    with pytest.raises(ValueError):
+        compare_expression_string_values("x + y", "x + z")
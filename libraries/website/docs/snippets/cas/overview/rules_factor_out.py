@@ -4,7 +4,8 @@ input = "4x + 2x"
 output = "(4 + 2) * x"
 parser = ExpressionParser()
 
-input_exp = parser.parse(input)
+# Parsed trees are shared by the parser, so change a clone of them
+input_exp = parser.parse(input).clone()
 output_exp = parser.parse(output)
 
 # Verify that the rule transforms the tree as expected
@@ -32,7 +32,8 @@ class PlusNegationRule(BaseRule):
 
 
 parser = ExpressionParser()
-expression = parser.parse("4x - 2x")
+# Parsed trees are shared by the parser, so change a clone of them
+expression = parser.parse("4x - 2x").clone()
 rule = PlusNegationRule()
 
 # Find a node and apply the rule